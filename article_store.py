@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Binary article store, a faster alternative to the CR-delimited CSV
+# written by xml_to_csv.py.
+#
+# File layout:
+#   STORE_MAGIC
+#   For each article:
+#     RECORD_HEADER (byte length of title, byte length of text)
+#     title (UTF-8)
+#     text (UTF-8)
+#
+# Article text is stored and read back exactly as page_generator_fast()
+# in moss_dump_analyzer.py reads it from the CSV, so reports see the
+# same text whichever file they read: write_record() adds the "\r"
+# article separator that the CSV reader leaves at the end of the text.
+# Both converters get page text with get_page_text(), so pages without
+# a <text> element have the text "None", which is what xml_to_csv.py
+# has always written for them.
+#
+# A companion index file (filename + INDEX_SUFFIX) has one line per
+# article: title, a tab, and the byte offset of its record header.
+#
+# Because records are length-prefixed, readers can skip from record
+# to record without decoding article text, and pool workers can be
+# handed byte offsets into a shared mmap instead of pickled text.
+
+import mmap
+import struct
+
+# The last byte is the format version; stores written before article
+# text ended with "\r" are version 1.
+STORE_MAGIC = b"MOSSART2"
+RECORD_HEADER = struct.Struct("<II")
+INDEX_SUFFIX = ".idx"
+
+
+def get_page_text(page_element):
+    # Text of an lxml <page> element, for either the CSV or the store
+    return str(page_element.findtext(".//text"))
+
+
+def write_record(store_file, article_title, article_text):
+    title_bytes = article_title.encode("utf-8")
+    text_bytes = (article_text + "\r").encode("utf-8")
+    store_file.write(RECORD_HEADER.pack(len(title_bytes), len(text_bytes)))
+    store_file.write(title_bytes)
+    store_file.write(text_bytes)
+
+
+def write_article_store(filename, pages):
+    # pages is an iterable of (article_title, article_text)
+    count = 0
+    with open(filename, "wb") as store_file, open(filename + INDEX_SUFFIX, "w") as index_file:
+        store_file.write(STORE_MAGIC)
+        for (article_title, article_text) in pages:
+            index_file.write(f"{article_title}\t{store_file.tell()}\n")
+            write_record(store_file, article_title, article_text)
+            count += 1
+    return count
+
+
+def is_article_store(filename):
+    with open(filename, "rb") as store_file:
+        return store_file.read(len(STORE_MAGIC) - 1) == STORE_MAGIC[:-1]
+
+
+def open_article_store(filename):
+    with open(filename, "rb") as store_file:
+        store = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+    # The mapping stays valid after the file is closed.
+    if store[:len(STORE_MAGIC) - 1] != STORE_MAGIC[:-1]:
+        raise Exception(f"Not an article store: {filename}")
+    if store[:len(STORE_MAGIC)] != STORE_MAGIC:
+        raise Exception(f"Article store {filename} is an old version; rebuild it with xml_to_csv.py --store")
+    return store
+
+
+def read_record(store, offset):
+    # Returns (article_title, article_text, offset of the next record)
+    (title_length, text_length) = RECORD_HEADER.unpack_from(store, offset)
+    title_start = offset + RECORD_HEADER.size
+    text_start = title_start + title_length
+    text_end = text_start + text_length
+    return (str(store[title_start:text_start], "utf-8"),
+            str(store[text_start:text_end], "utf-8"),
+            text_end)
+
+
+def record_offsets(store, start=None, end=None):
+    # Only reads record headers; article text is not touched.
+    offset = start or len(STORE_MAGIC)
+    end = end or len(store)
+    while offset < end:
+        yield offset
+        (title_length, text_length) = RECORD_HEADER.unpack_from(store, offset)
+        offset += RECORD_HEADER.size + title_length + text_length
+
+
+def page_generator_store(filename, start=None, end=None):
+    store = open_article_store(filename)
+    offset = start or len(STORE_MAGIC)
+    end = end or len(store)
+    while offset < end:
+        (article_title, article_text, offset) = read_record(store, offset)
+        yield (article_title, article_text)
+
+
+def load_index(filename):
+    # Returns a dictionary of article title -> record offset
+    index = {}
+    with open(filename + INDEX_SUFFIX, "r") as index_file:
+        for line in index_file:
+            (article_title, offset) = line.rstrip("\n").rsplit("\t", 1)
+            index[article_title] = int(offset)
+    return index
+
+
+def shard_boundaries(store, num_shards):
+    # Splits the store into num_shards (start, end) byte ranges of
+    # roughly equal size, each starting on a record boundary.
+    shard_size = (len(store) - len(STORE_MAGIC)) // num_shards + 1
+    starts = [len(STORE_MAGIC)]
+    for offset in record_offsets(store):
+        if offset >= starts[-1] + shard_size:
+            starts.append(offset)
+    ends = starts[1:] + [len(store)]
+    return list(zip(starts, ends))
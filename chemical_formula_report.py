@@ -2,7 +2,7 @@ from collections import defaultdict
 import mysql.connector
 import re
 from moss_dump_analyzer import read_en_article_text
-from wikitext_util import wikitext_to_plaintext, get_main_body_wikitext
+from plaintext_cache import get_plaintext
 
 mysql_connection = mysql.connector.connect(user='beland',
                                            host='127.0.0.1',
@@ -34,8 +34,7 @@ articles_by_formula = defaultdict(list)
 
 
 def chem_formula_check(article_title, article_text):
-    article_text = wikitext_to_plaintext(article_text, flatten_sup_sub=False)
-    article_text = get_main_body_wikitext(article_text)
+    article_text = get_plaintext(article_text, flatten_sup_sub=False)
 
     # If we ever start looking inside templates, we will need
     # something like this to avoid false alarms for [[Template:Infobox
@@ -75,5 +74,5 @@ def dump_results():
 
 if __name__ == '__main__':
     # Run time: ~2h40m (8-core parallel)
-    read_en_article_text(chem_formula_check, process_result_callback=add_tuples_to_results, parallel=True)
+    read_en_article_text(chem_formula_check, process_result_callback=add_tuples_to_results, parallel=True, sharded=True)
     dump_results()
@@ -17,9 +17,8 @@ FIND_RE = re.compile(sys.argv[1])
 def grep_page(article_title, article_text):
     for article_line in article_text.splitlines():
         if FIND_RE.search(article_line):
-            # Avoid print() due to possible race condition with newlines
-            sys.stdout.write(f"{article_title}: {article_line}\n")
+            print(f"{article_title}: {article_line}")
 
 
 if __name__ == "__main__":
-    read_en_article_text(grep_page, parallel=True)
+    read_en_article_text(grep_page, parallel=True, sharded=True)
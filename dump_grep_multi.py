@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import re
+import sys
+from moss_dump_analyzer import read_en_article_text
+
+# Single-pass alternative to running dump_grep_csv.py once per regex.
+# Reads the dump once, tests every line against every regex in a
+# manifest file, and writes the matches for each report to its own
+# output file, in the same "Title: line" format as dump_grep_csv.py.
+#
+# Manifest format, one report per line, tab-separated:
+#  name<TAB>output file<TAB>regex
+# Blank lines and lines starting with "#" are ignored.
+
+# For example:
+# venv/bin/python3 dump_grep_multi.py dump_grep_manifest1.tsv
+
+
+def load_manifest(filename):
+    reports = []
+    with open(filename, "r") as manifest_file:
+        for line in manifest_file:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            (name, output_filename, regex) = line.split("\t", 2)
+            reports.append((name, output_filename, re.compile(regex)))
+    return reports
+
+
+if len(sys.argv) != 2:
+    print("Please specify a manifest file on the command line")
+    exit(1)
+
+REPORTS = load_manifest(sys.argv[1])
+FIND_RES = [(report_index, find_re) for (report_index, (_, _, find_re)) in enumerate(REPORTS)]
+
+
+def grep_page_multi(article_title, article_text):
+    matches = []
+    for article_line in article_text.splitlines():
+        for (report_index, find_re) in FIND_RES:
+            if find_re.search(article_line):
+                matches.append((report_index, f"{article_title}: {article_line}\n"))
+    return matches or None
+
+
+if __name__ == "__main__":
+    output_files = [open(output_filename, "w") for (_, output_filename, _) in REPORTS]
+    match_counts = [0] * len(REPORTS)
+
+    def write_matches(matches):
+        # Runs in the parent process, so writes don't interleave
+        for (report_index, output_line) in matches:
+            output_files[report_index].write(output_line)
+            match_counts[report_index] += 1
+
+    read_en_article_text(grep_page_multi, process_result_callback=write_matches, parallel=True, sharded=True)
+
+    for (output_file, (name, output_filename, _), match_count) in zip(output_files, REPORTS, match_counts):
+        output_file.close()
+        print(f"{name}: {match_count} lines -> {output_filename}", file=sys.stderr)
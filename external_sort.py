@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# Sorting more tuples of strings than fit in memory.  Callers collect
+# tuples in a list, and whenever it gets too long, call spill_run() to
+# sort it and write it ("spill" it) to a temporary file.  At the end,
+# merge_runs() returns everything in sorted order, from the files plus
+# whatever is left in the list.
+#
+# Strings must not contain tabs or newlines (true of article titles
+# and words).  Set MOSS_SPILL_DIR to put the temporary files somewhere
+# other than the default temporary directory.
+
+import heapq
+import os
+import shutil
+import tempfile
+
+spill_directory = None
+
+
+def spill_run(items):
+    # Sorts and writes items to a new temporary file, empties items,
+    # and returns the filename
+    global spill_directory
+    if not spill_directory:
+        spill_directory = tempfile.mkdtemp(prefix="moss-spill-", dir=os.environ.get("MOSS_SPILL_DIR"))
+    items.sort()
+    (run_fd, run_filename) = tempfile.mkstemp(dir=spill_directory)
+    with open(run_fd, "w", encoding="utf-8") as run_file:
+        run_file.writelines("\t".join(item) + "\n" for item in items)
+    items.clear()
+    return run_filename
+
+
+def read_run(run_filename):
+    with open(run_filename, "r", encoding="utf-8") as run_file:
+        for line in run_file:
+            yield tuple(line[:-1].split("\t"))
+
+
+def merge_runs(items, run_filenames):
+    items.sort()
+    return heapq.merge(items, *[read_run(run_filename) for run_filename in run_filenames])
+
+
+def remove_runs():
+    # Deletes all spilled files once they have been merged
+    global spill_directory
+    if spill_directory:
+        shutil.rmtree(spill_directory)
+        spill_directory = None
@@ -3,16 +3,59 @@
 # http://dumps.wikimedia.org/backup-index.html
 # http://meta.wikimedia.org/wiki/Data_dumps
 
+from collections import deque
 import datetime
-from multiprocessing import Pool
+from functools import partial
+import io
+from itertools import islice
+from multiprocessing import Pool, Queue
+import os
 import re
 import sys
+from article_store import (is_article_store, open_article_store, page_generator_store, read_record, record_offsets,
+                           shard_boundaries)
+from result_cache import cached_callback, create_cache, finish_cache, get_cache_filename, make_cache_result_callback
 
 # Runtime: ~1.5 hours (with a simple callback, whata, single-threaded)
 
 DEFAULT_CSV_FILE = "/var/local/moss/bulk-wikipedia/enwiki-articles-no-redir.csv"
+DEFAULT_STORE_FILE = "/var/local/moss/bulk-wikipedia/enwiki-articles-no-redir.bin"
 PAGE_RE = re.compile(r"^.*(<page.*?</page>).*$", flags=re.MULTILINE+re.DOTALL)
 
+# Articles are sent to workers in batches of BATCH_SIZE, with at most
+# BATCHES_IN_FLIGHT_PER_WORKER batches per worker waiting or running
+# at any time so memory use stays flat.
+BATCH_SIZE = 100
+BATCHES_IN_FLIGHT_PER_WORKER = 4
+
+# Sharded mode: each worker gets SHARDS_PER_WORKER byte ranges on
+# average, so one slow shard doesn't leave the other cores idle at the
+# end of the run.  Results come back to the parent in batches of
+# RESULT_BATCH_SIZE.
+SHARDS_PER_WORKER = 4
+RESULT_BATCH_SIZE = 1000
+CSV_READ_SIZE = 16 * 1024 * 1024
+
+# Anything worker processes print is buffered and sent to the parent
+# process along with their results (sooner if there are more than
+# OUTPUT_BATCH_SIZE characters), and the parent writes it to standard
+# output.  This avoids a write per line from each worker and lines
+# from different workers getting mixed together.
+OUTPUT_BATCH_SIZE = 1024 * 1024
+
+# The file read_en_article_text() is reading (inherited by worker
+# processes), so per-dump caches like plaintext_cache.py can use the
+# one for that file
+article_filename = None
+
+# Set in each worker process by init_store_worker() or
+# init_shard_worker()
+worker_store = None
+worker_callback = None
+worker_filename = None
+worker_queue = None
+worker_output = None
+
 
 def print_result(result):
     # Print from parent process to avoid race conditions
@@ -20,32 +63,275 @@ def print_result(result):
         print(result)
 
 
-def read_en_article_text(callback_function, filename=DEFAULT_CSV_FILE, parallel=False, process_result_callback=print_result):
+def print_error(exception):
+    # An exception in a callback loses the results for the rest of its
+    # batch, so make sure it's noticed.
+    print(f"Error in worker: {exception!r}", file=sys.stderr)
+
+
+def write_output(output):
+    if output:
+        sys.stdout.write(output)
+
+
+def capture_worker_output():
+    global worker_output
+    worker_output = io.StringIO()
+    sys.stdout = worker_output
+
+
+def take_worker_output():
+    # Returns and clears everything printed since the last call
+    output = worker_output.getvalue()
+    worker_output.seek(0)
+    worker_output.truncate()
+    return output
+
+
+def get_default_filename():
+    # Prefer the binary article store (see article_store.py) if
+    # xml_to_csv.py has produced one.
+    if os.path.exists(DEFAULT_STORE_FILE):
+        return DEFAULT_STORE_FILE
+    return DEFAULT_CSV_FILE
+
+
+def get_worker_count(workers=None):
+    # Explicit argument, then MOSS_WORKERS environment variable, then
+    # number of CPUs
+    if workers:
+        return workers
+    return int(os.environ.get("MOSS_WORKERS") or 0) or os.cpu_count()
+
+
+def init_batch_worker(callback_function, filename):
+    # For the article store, each worker maps the file once; the
+    # parent only sends record offsets, so article text is never
+    # pickled.
+    global worker_store
+    global worker_callback
+    if is_article_store(filename):
+        worker_store = open_article_store(filename)
+    worker_callback = callback_function
+    capture_worker_output()
+
+
+def process_store_batch(offsets):
+    results = []
+    for offset in offsets:
+        (article_title, article_text, _) = read_record(worker_store, offset)
+        result = worker_callback(article_title, article_text)
+        if result is not None:
+            results.append(result)
+    return (take_worker_output(), results)
+
+
+def process_text_batch(pages):
+    results = []
+    for (article_title, article_text) in pages:
+        result = worker_callback(article_title, article_text)
+        if result is not None:
+            results.append(result)
+    return (take_worker_output(), results)
+
+
+def make_batches(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def init_shard_worker(callback_function, filename, queue):
+    global worker_callback
+    global worker_filename
+    global worker_queue
+    worker_callback = callback_function
+    worker_filename = filename
+    worker_queue = queue
+    capture_worker_output()
+
+
+def process_shard(shard):
+    # Runs in a worker process: reads one byte range of the dump
+    # directly and streams non-empty results back to the parent.
+    (start, end) = shard
+    results = []
+    count = 0
+    try:
+        for (article_title, article_text) in page_generator_range(worker_filename, start, end):
+            result = worker_callback(article_title, article_text)
+            count += 1
+            if result is not None:
+                results.append(result)
+            if len(results) >= RESULT_BATCH_SIZE or worker_output.tell() >= OUTPUT_BATCH_SIZE:
+                worker_queue.put((0, take_worker_output(), results))
+                results = []
+        worker_queue.put((count, take_worker_output(), results))
+    finally:
+        # None tells the parent this shard is finished, even if the
+        # callback raised an exception.
+        worker_queue.put(None)
+
+
+def read_en_article_text_sharded(callback_function, filename, process_result_callback=print_result, workers=None):
+    # Unlike the default parallel mode, the parent process never reads
+    # or pickles article text, so throughput scales with the number of
+    # workers instead of being capped by the parent.
+    workers = get_worker_count(workers)
+    shards = get_shard_boundaries(filename, workers * SHARDS_PER_WORKER)
+    queue = Queue(maxsize=workers * 4)
+    count = 0
+    with Pool(workers, initializer=init_shard_worker, initargs=(callback_function, filename, queue)) as pool:
+        shards_result = pool.map_async(process_shard, shards, chunksize=1)
+        shards_done = 0
+        while shards_done < len(shards):
+            batch = queue.get()
+            if batch is None:
+                shards_done += 1
+                print(f"Finished {shards_done}/{len(shards)} shards, {count} articles - "
+                      + str(datetime.datetime.now().isoformat()),
+                      file=sys.stderr)
+                continue
+            (shard_count, output, results) = batch
+            count += shard_count
+            write_output(output)
+            for result in results:
+                process_result_callback(result)
+        # Re-raises any exception from a worker
+        shards_result.get()
+        pool.close()
+        pool.join()
+
+
+def read_en_article_text(callback_function, filename=None, parallel=False, process_result_callback=print_result,
+                         sharded=False, workers=None, cache_name=None, cache_version=""):
+    # cache_name (parallel modes only): replay the previous run's
+    # output and results for articles whose text hasn't changed; see
+    # result_cache.py.
+    global article_filename
     if not filename:
         # Necessary backstop for dump_grep_regex.py
-        filename = DEFAULT_CSV_FILE
-    count = 0
-    if parallel:
-        with Pool(8) as pool:
-            for (article_title, article_text) in page_generator_fast(filename):
-                result = pool.apply_async(callback_function, args=[article_title, article_text], callback=process_result_callback)
-                count += 1
-                if count % 100000 == 0:
-                    # Prevent results from child processes from piling up
-                    # waiting for the parent process to deal with
-                    # callbacks.  (This can consume all available memory
-                    # because article text isn't garbage collected until
-                    # the callback is complete.)
-                    result.wait()
-                    print(f"Processed {count} articles - " + str(datetime.datetime.now().isoformat()),
-                          file=sys.stderr)
-            pool.close()
-            pool.join()
+        filename = get_default_filename()
+    article_filename = filename
+    if parallel and cache_name:
+        cache_filename = get_cache_filename(filename, cache_name)
+        cache = create_cache(cache_filename, cache_version)
+        cache_stats = [0, 0]
+        read_en_article_text(partial(cached_callback, callback_function, cache_filename, cache_version), filename,
+                             parallel=True,
+                             process_result_callback=make_cache_result_callback(cache, process_result_callback, cache_stats),
+                             sharded=sharded, workers=workers)
+        finish_cache(cache, cache_filename)
+        print(f"Cache {cache_name}: {cache_stats[1]} articles replayed, {cache_stats[0]} checked", file=sys.stderr)
+    elif parallel and sharded:
+        read_en_article_text_sharded(callback_function, filename, process_result_callback, workers=workers)
+    elif parallel:
+        read_en_article_text_batched(callback_function, filename, process_result_callback, workers=workers)
     else:
-        for (article_title, article_text) in page_generator_fast(filename):
+        for (article_title, article_text) in page_generator(filename):
             callback_function(article_title, article_text)
 
 
+def read_en_article_text_batched(callback_function, filename, process_result_callback=print_result, workers=None):
+    workers = get_worker_count(workers)
+    if is_article_store(filename):
+        batch_function = process_store_batch
+        items = record_offsets(open_article_store(filename))
+    else:
+        batch_function = process_text_batch
+        items = page_generator_fast(filename)
+
+    def process_batch_results(batch):
+        (output, results) = batch
+        write_output(output)
+        for result in results:
+            process_result_callback(result)
+
+    count = 0
+    in_flight = deque()
+    with Pool(workers, initializer=init_batch_worker, initargs=(callback_function, filename)) as pool:
+        for batch in make_batches(items, BATCH_SIZE):
+            if len(in_flight) >= workers * BATCHES_IN_FLIGHT_PER_WORKER:
+                # Prevent results from child processes from piling up
+                # waiting for the parent process to deal with
+                # callbacks.  (This can consume all available memory
+                # because article text isn't garbage collected until
+                # the callback is complete.)  The callback has run by
+                # the time wait() returns.
+                in_flight.popleft().wait()
+            in_flight.append(pool.apply_async(batch_function, args=[batch],
+                                              callback=process_batch_results, error_callback=print_error))
+            count += len(batch)
+            if count % 100000 < len(batch):
+                print(f"Processed {count} articles - " + str(datetime.datetime.now().isoformat()),
+                      file=sys.stderr)
+        pool.close()
+        pool.join()
+
+
+def page_generator(filename=None):
+    if not filename:
+        filename = get_default_filename()
+    if is_article_store(filename):
+        return page_generator_store(filename)
+    return page_generator_fast(filename)
+
+
+def get_shard_boundaries(filename, num_shards):
+    # Returns a list of (start, end) byte ranges that each begin on an
+    # article boundary.
+    if is_article_store(filename):
+        return shard_boundaries(open_article_store(filename), num_shards)
+
+    file_size = os.path.getsize(filename)
+    starts = [0]
+    with open(filename, "rb") as csv_file:
+        for i in range(1, num_shards):
+            csv_file.seek(max(file_size * i // num_shards, starts[-1]))
+            # Skip the rest of the article the seek landed in
+            while True:
+                chunk = csv_file.read(4096)
+                if not chunk:
+                    break
+                cr_index = chunk.find(b"\r")
+                if cr_index > -1:
+                    csv_file.seek(cr_index + 1 - len(chunk), os.SEEK_CUR)
+                    break
+            if csv_file.tell() < file_size:
+                starts.append(csv_file.tell())
+    starts = sorted(set(starts))
+    ends = starts[1:] + [file_size]
+    return list(zip(starts, ends))
+
+
+def page_generator_range(filename, start, end):
+    if is_article_store(filename):
+        yield from page_generator_store(filename, start, end)
+        return
+
+    with open(filename, "rb") as csv_file:
+        csv_file.seek(start)
+        remaining = end - start
+        leftover = b""
+        while remaining > 0:
+            chunk = csv_file.read(min(CSV_READ_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            lines = (leftover + chunk).split(b"\r")
+            leftover = lines.pop()
+            for line in lines:
+                (article_title, article_text) = line.decode("utf-8").split("\t", 1)
+                # Match page_generator_fast(), which keeps the separator
+                yield (article_title, article_text + "\r")
+        if leftover:
+            (article_title, article_text) = leftover.decode("utf-8").split("\t", 1)
+            yield (article_title, article_text)
+
+
 def page_generator_fast(filename=DEFAULT_CSV_FILE):
     # Using formfeed as line separator so article text can have newlines.
     with open(filename, "r", newline="\r") as article_xml_file:
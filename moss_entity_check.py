@@ -1,9 +1,13 @@
+from html.entities import html5
 from moss_dump_analyzer import read_en_article_text
+from needle_counter import count_needles, make_needle_counter, may_contain_needles, tally_chars
 import re
+from result_cache import get_files_version
 import sys
 from unencode_entities import (
     alert, keep, controversial, transform, greek_letters, find_char_num,
     entities_re, fix_text, should_keep_as_is)
+from wikitext_util import apply_substitutions, compile_substitutions
 
 low_priority = "０１２３４５６７８９ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚ" \
     "¹²³⁴⁵⁶⁷⁸⁹⁰ⁱ⁺⁻⁼⁽⁾ᵃᵇᶜᵈᵉᶠᵍʰⁱʲᵏˡᵐⁿᵒᵖʳˢᵗᵘᵛʷˣʸᶻᴬᴮᴰᴱᴳᴴᴵᴶᴷᴸᴹᴺᴼᴾᴿᵀᵁⱽᵂ₀₁₂₃₄₅₆₇₈₉₊₋₌₍₎ₐₑₕᵢⱼₖₗₘₙₒₚᵣₛₜᵤᵥₓꟹᵝᵞᵟᵋᶿᶥᶹᵠᵡᵦᵧᵨᵩᵪᵅᶜ̧ᶞᵊᶪᶴᶵꭩˀₔᵑ"
@@ -12,6 +16,8 @@ strings_found_by_type = {}
 non_entity_transform = [string for string
                         in list(transform.keys()) + list(controversial.keys())
                         if not string.startswith("&")]
+non_entity_transform_counter = make_needle_counter(non_entity_transform)
+alert_counter = make_needle_counter(alert)
 
 # -- PERFORMANCE NOTES --
 
@@ -44,6 +50,10 @@ non_entity_transform = [string for string
 # In code:
 # for (_end_index, instance) in alert_automaton.iter(article_text):
 
+# Counting only the needles whose non-ASCII character is in the article
+# (see needle_counter.py) is much faster than one string.count() per
+# needle, since most articles have few distinct non-ASCII characters.
+
 # --
 
 article_blocklist = [
@@ -533,9 +543,14 @@ needs_ipa_detect_re = re.compile(r"{{[Nn]eeds IPA", flags=re.S)
 needs_ipa_remove_re = re.compile(r".{0,100}{{[Nn]eeds IPA.*?}}", flags=re.S)
 
 
+# Each pattern is only run if one of its trigger strings (see
+# wikitext_util.compile_substitutions()) is in the text, e.g. "<code"
+# or "[[file:"; most articles need few or none of them.
+suppression_steps = compile_substitutions([(pattern, "") for pattern in suppression_patterns])
+
+
 def get_redacted_article_text(article_text):
-    for pattern in suppression_patterns:
-        article_text = pattern.sub("", article_text)
+    article_text = apply_substitutions(article_text, suppression_steps)
 
     if needs_ipa_detect_re.search(article_text):
         article_text = needs_ipa_remove_re.sub("", article_text)
@@ -561,49 +576,65 @@ def entity_check(article_title, article_text):
     result_tuples = []
     article_text_redacted = None
 
+    # Distinct non-ASCII characters (and &, <, `) in the article.  Most
+    # articles contain none of the characters the subchecks look for,
+    # and skip them entirely.
+    article_chars = tally_chars(article_text)
+
     # This is the fastest check
-    results_tmp = subcheck_html_entity(article_text, article_title)
+    results_tmp = None
+    if "&" in article_chars:
+        results_tmp = subcheck_html_entity(article_text, article_title)
     if results_tmp:
         article_text_redacted = get_redacted_article_text(article_text)
-        result_tuples.extend(subcheck_html_entity(article_text_redacted, article_title))
+        if article_text_redacted == article_text:
+            # Nothing was redacted
+            result_tuples.extend(results_tmp)
+        else:
+            result_tuples.extend(subcheck_html_entity(article_text_redacted, article_title))
 
     # This check hits most often but is somewhat slow, so it's better to run it on redacted text
     if article_text_redacted:
         result_tuples.extend(subcheck_non_entity(article_text_redacted, article_title))
-    else:
-        results_tmp = subcheck_non_entity(article_text, article_title)
+    elif may_contain_needles(non_entity_transform_counter, article_chars):
+        results_tmp = subcheck_non_entity(article_text, article_title, char_counts=article_chars)
         if results_tmp:
             # Hint avoids redoing a lot of work
             article_text_redacted = get_redacted_article_text(article_text)
-            found_check_strings = set([tup[2] for tup in results_tmp])
-            result_tuples.extend(subcheck_non_entity(article_text_redacted, article_title, hint=found_check_strings))
+            if article_text_redacted == article_text:
+                result_tuples.extend(results_tmp)
+            else:
+                found_check_strings = set([tup[2] for tup in results_tmp])
+                result_tuples.extend(subcheck_non_entity(article_text_redacted, article_title, hint=found_check_strings))
 
     # This check is the least likely to hit, and is somewhat slow so it's better to run on redacted text
     if article_text_redacted:
         result_tuples.extend(subcheck_alert(article_text_redacted, article_title))
-    else:
-        results_tmp = subcheck_alert(article_text, article_title)
+    elif may_contain_needles(alert_counter, article_chars):
+        results_tmp = subcheck_alert(article_text, article_title, char_counts=article_chars)
         if results_tmp:
             # Hint avoids redoing a lot of work
             article_text_redacted = get_redacted_article_text(article_text)
-            found_check_strings = set([tup[2] for tup in results_tmp])
-            result_tuples.extend(subcheck_alert(article_text_redacted, article_title, hint=found_check_strings))
+            if article_text_redacted == article_text:
+                result_tuples.extend(results_tmp)
+            else:
+                found_check_strings = set([tup[2] for tup in results_tmp])
+                result_tuples.extend(subcheck_alert(article_text_redacted, article_title, hint=found_check_strings))
 
     return result_tuples
 
 
 # hint is a list of the only characters that can possibly be in article_text
-def subcheck_alert(article_text, article_title, hint=None):
+# char_counts is needle_counter.tally_chars(article_text), if already known
+def subcheck_alert(article_text, article_title, hint=None, char_counts=None):
     result_tuples = []
 
-    # Weirdly, this is a lot faster than a pre-compiled regular
-    # expression or Aho-Corasick automaton.
-    # if not any(alert_word in article_text for alert_word in alert):
-    #     return
-    # for instance in alert_re.findall(article_text):
+    if hint:
+        found_counts = [(check_string, article_text.count(check_string)) for check_string in hint]
+    else:
+        found_counts = count_needles(alert_counter, article_text, char_counts)
 
-    for check_string in hint or alert:
-        found_count = article_text.count(check_string)
+    for (check_string, found_count) in found_counts:
         if not found_count:
             continue
 
@@ -617,15 +648,19 @@ def subcheck_alert(article_text, article_title, hint=None):
     return result_tuples
 
 
-def subcheck_non_entity(article_text, article_title, hint=None):
+def subcheck_non_entity(article_text, article_title, hint=None, char_counts=None):
     result_tuples = []
 
     article_text_lower = None
     # Not constructing here because it's rarely needed and uses a lot
     # of CPU (.5 sec per 10,000 articles)
 
-    for check_string in hint or non_entity_transform:
-        found_count = article_text.count(check_string)
+    if hint:
+        found_counts = [(check_string, article_text.count(check_string)) for check_string in hint]
+    else:
+        found_counts = count_needles(non_entity_transform_counter, article_text, char_counts)
+
+    for (check_string, found_count) in found_counts:
         if not found_count:
             continue
 
@@ -676,63 +711,109 @@ def subcheck_non_entity(article_text, article_title, hint=None):
     return result_tuples
 
 
+# Verdict for each distinct entity string, from the entity tables
+# alone; the checks that depend on the article text are done in
+# subcheck_html_entity().  Preloaded (before the worker processes are
+# forked) with every named HTML5 entity and every entity in the
+# tables, and filled in as other (mostly numeric) entities are found.
+entity_verdicts = {}
+
+
+def classify_entity(entity):
+    if entity in keep or entity in alert:
+        # alert is handled by subcheck_alert()
+        return "keep"
+    if entity in ["&#91;", "&#93;"]:
+        return "low_priority"
+    if entity in controversial:
+        return "controversial"
+    if entity in greek_letters:
+        return "greek"
+    if should_keep_as_is(entity):
+        # Excludes numeric ranges that must remain untouched
+        return "keep"
+    if find_char_num(entity):
+        return "numeric"
+    if entity in transform:
+        return "transform"
+    return "unknown"
+
+
+def get_entity_verdict(entity):
+    verdict = entity_verdicts.get(entity)
+    if verdict is None:
+        verdict = entity_verdicts[entity] = classify_entity(entity)
+    return verdict
+
+
+for known_entity in ["&" + name for name in html5 if name.endswith(";")] + keep + alert + list(controversial) + list(greek_letters) + list(transform):
+    if entities_re.fullmatch(known_entity):
+        get_entity_verdict(known_entity)
+
+
 def subcheck_html_entity(article_text, article_title):
     result_tuples = []
 
+    # Facts about the article that some verdicts depend on, found the
+    # first time they are needed rather than once per entity
+    has_chinese = None
+    has_math = None
+    has_meson = None
+
     # This is super fast, probably because "&" is an uncommon character
     for entity in entities_re.findall(article_text):
-        if entity in keep:
-            continue
-        if entity in alert:
-            # Handled above
+        verdict = get_entity_verdict(entity)
+        if verdict == "keep":
             continue
 
-        if entity in ["&#91;", "&#93;"]:
+        if verdict == "low_priority":
             result_tuples.append(("LOW_PRIORITY", article_title, entity))
             continue
 
-        if entity in ["&ast;", "¹", "²", "³", "⁴", "⁵", "⁶", "⁷", "⁸", "⁹"]:
-            if ("{{Infobox Chinese" in article_text
-                    or "{{infobox Chinese" in article_text
-                    or "{{Chinese" in article_text):
+        if entity == "&ast;":
+            if has_chinese is None:
+                has_chinese = ("{{Infobox Chinese" in article_text
+                               or "{{infobox Chinese" in article_text
+                               or "{{Chinese" in article_text)
+            if has_chinese:
                 # Legitimate use to prevent interpretation as wikitext list syntax
                 continue
 
-        if entity in controversial or entity in greek_letters:
-            if "<math" in article_text:
+        if verdict == "controversial" or verdict == "greek":
+            if has_math is None:
+                has_math = "<math" in article_text
+            if has_math:
                 # Editors in these types of articles prefer the HTML
                 # entity so that special characters can be found by
                 # name in both TeX and HTML markup.
                 continue
 
-            if entity in controversial:
+            if verdict == "controversial":
                 result_tuples.append(("CONTROVERSIAL", article_title, entity))
                 continue
-            if entity in greek_letters:
-
-                # eta, pi, phi, rho, omega, upsilon
-                if any(meson in article_text for meson in ["ta meson", "i meson", "ho meson", "mega meson", "psilon meson", "scalar meson"]):
-                    # Per User:Headbomb
-                    continue
 
-                result_tuples.append(("GREEK", article_title, entity))
+            # eta, pi, phi, rho, omega, upsilon
+            if has_meson is None:
+                has_meson = any(meson in article_text for meson in ["ta meson", "i meson", "ho meson", "mega meson", "psilon meson", "scalar meson"])
+            if has_meson:
+                # Per User:Headbomb
                 continue
 
+            result_tuples.append(("GREEK", article_title, entity))
+            continue
+
         if (entity == "&semi;") and "lim=" in article_text:
             # Needed for {{linktext |lim=&semi;{{sp}} |...}}
             # Use {{sp}} instead of &ensp;
             continue
-        if should_keep_as_is(entity):
-            # Excludes numeric ranges that must remain untouched
-            continue
-        if find_char_num(entity):
+        if verdict == "numeric":
             # Intentionally mixing both known and unknown, all of
             # which can usually be handled seamlessly, though not
             # including numeric entities in the "alert" section,
             # which by definition can't be handled automatically.
             result_tuples.append(("NUMERIC", article_title, entity))
             continue
-        if entity in transform:
+        if verdict == "transform":
             result_tuples.append(("UNCONTROVERSIAL", article_title, entity))
             continue
         elif entity == entity.upper() and re.search("[A-Z]+%s" % entity, article_text):
@@ -937,5 +1018,10 @@ def dump_results():
 
 
 if __name__ == '__main__':
-    read_en_article_text(entity_check, process_result_callback=add_tuples_to_results, parallel=True)
+    # unencode_entities changes its tables for --safe, so the command
+    # line is part of the cache version.
+    cache_version = get_files_version([__file__] + [sys.modules[name].__file__ for name in ["needle_counter", "unencode_entities", "wikitext_util"]],
+                                      extra=" ".join(sys.argv[1:]))
+    read_en_article_text(entity_check, process_result_callback=add_tuples_to_results, parallel=True, sharded=True,
+                         cache_name="entities", cache_version=cache_version)
     dump_results()
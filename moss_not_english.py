@@ -8,8 +8,10 @@ import gcld3
 import re
 import sys
 from moss_dump_analyzer import read_en_article_text
-from moss_entity_check import suppression_patterns
-from wikitext_util import wikitext_to_plaintext, get_main_body_wikitext, ignore_tags_re
+from moss_entity_check import suppression_steps
+from plaintext_cache import get_plaintext
+from wikitext_util import apply_substitutions, ignore_tags_re
+from word_table import load_word_table, word_table_contains
 
 # Set this to false if you want to find individual words that need {{lang}}
 ONLY_LONG_SEGMENTS = True
@@ -25,10 +27,9 @@ GOOGLE_LANG_DETECTOR = gcld3.NNetLanguageIdentifier(min_num_bytes=0,
 
 print("Loading dictionaries...", file=sys.stderr)
 
-with open("/var/local/moss/bulk-wikipedia/titles_all_wiktionaries_uniq.txt", "r") as title_list:
-    ALL_WORDS = set(word.strip() for word in title_list)
-with open("/var/local/moss/bulk-wikipedia/english_words_only.txt", "r") as title_list:
-    ENGLISH_WORDS = set(word.strip() for word in title_list)
+# Memory-mapped so pool workers share one copy
+ALL_WORDS = load_word_table("/var/local/moss/bulk-wikipedia/titles_all_wiktionaries_uniq.txt")
+ENGLISH_WORDS = load_word_table("/var/local/moss/bulk-wikipedia/english_words_only.txt")
 
 SPECIES_WORDS = list()
 for filename in [
@@ -58,7 +59,7 @@ print("Done loading.", file=sys.stderr)
 
 
 def is_correct_word(word):
-    if word in ALL_WORDS:
+    if word_table_contains(ALL_WORDS, word):
         return True
     # if word.lower() in ALL_WORDS:
     #     return True
@@ -66,19 +67,47 @@ def is_correct_word(word):
 
 
 def is_english_word(word):
-    if word in ENGLISH_WORDS:
+    if word_table_contains(ENGLISH_WORDS, word):
         return True
     word_lower = word.lower()
-    if word_lower in ENGLISH_WORDS:
+    if word_table_contains(ENGLISH_WORDS, word_lower):
         return True
     if word.endswith("'s"):
-        if word[0:-2] in ENGLISH_WORDS:
+        if word_table_contains(ENGLISH_WORDS, word[0:-2]):
             return True
-        if word_lower[0:-2] in ENGLISH_WORDS:
+        if word_table_contains(ENGLISH_WORDS, word_lower[0:-2]):
             return True
     return False
 
 
+# Returns None if word_mixedcase should not be counted, otherwise
+# (language code, whether it counts as non-English)
+def get_word_lang(word_mixedcase):
+    if len(word_mixedcase) <= 3:
+        # Not long enough for the language classifier to
+        # really work on. This also excludes the use of a lot
+        # of Greek variables in STEM articles.
+        return None
+
+    if is_english_word(word_mixedcase) or word_mixedcase in SPECIES_WORDS:
+        return ("en", False)
+
+    if word_mixedcase[0].upper() == word_mixedcase[0]:
+        # Capitalized words are usually proper nouns; not helpful
+        # for categorization
+        return None
+    if ACRONYM_RE.match(word_mixedcase):
+        return None
+    if NUMBER_INSIDE_RE.search(word_mixedcase):
+        # These are pretty much always science terms like genes
+        return None
+
+    lang_code = GOOGLE_LANG_DETECTOR.FindLanguage(word_mixedcase).language
+    if not is_correct_word(word_mixedcase):
+        lang_code = lang_code + "?"
+    return (lang_code, True)
+
+
 def find_non_english(article_title, article_text):
     if ignore_tags_re.search(article_text):
         return
@@ -88,12 +117,11 @@ def find_non_english(article_title, article_text):
     if request_search_string_en in REQUESTED_SPECIES_HTML or request_search_string_w in REQUESTED_SPECIES_HTML:
         return
 
-    article_text = wikitext_to_plaintext(article_text)
-    article_text = get_main_body_wikitext(article_text)
-    for pattern in suppression_patterns:
-        article_text = pattern.sub("", article_text)
+    article_text = get_plaintext(article_text)
+    article_text = apply_substitutions(article_text, suppression_steps)
     article_text = article_text.replace("✂", " ")
     article_words_by_lang = defaultdict(list)
+    word_langs = {}
 
     paragraphs = article_text.split("\n")
     for paragraph_text in paragraphs:
@@ -107,30 +135,15 @@ def find_non_english(article_title, article_text):
 
         non_english_count = 0
         for word_mixedcase in word_list:
-            if len(word_mixedcase) <= 3:
-                # Not long enough for the language classifier to
-                # really work on. This also excludes the use of a lot
-                # of Greek variables in STEM articles.
-                continue
-
-            if is_english_word(word_mixedcase) or word_mixedcase in SPECIES_WORDS:
-                paragraph_words_by_lang["en"].append(word_mixedcase)
-                continue
-
-            if word_mixedcase[0].upper() == word_mixedcase[0]:
-                # Capitalized words are usually proper nouns; not helpful
-                # for categorization
+            # Words repeat a lot within an article, so only classify
+            # each one once
+            if word_mixedcase not in word_langs:
+                word_langs[word_mixedcase] = get_word_lang(word_mixedcase)
+            if not word_langs[word_mixedcase]:
                 continue
-            if ACRONYM_RE.match(word_mixedcase):
-                continue
-            if NUMBER_INSIDE_RE.search(word_mixedcase):
-                # These are pretty much always science terms like genes
-                continue
-
-            lang_code = GOOGLE_LANG_DETECTOR.FindLanguage(word_mixedcase).language
-            if not is_correct_word(word_mixedcase):
-                lang_code = lang_code + "?"
-            non_english_count += 1
+            (lang_code, is_non_english) = word_langs[word_mixedcase]
+            if is_non_english:
+                non_english_count += 1
             paragraph_words_by_lang[lang_code].append(word_mixedcase)
 
         if non_english_count == 0:
@@ -168,9 +181,9 @@ def find_non_english(article_title, article_text):
         output_line += "\t" + ", ".join(article_words_by_lang[lang][0:10])
         break  # Only report examples from the most commonly detected non-English language
 
-    print(output_line, flush=True)
+    print(output_line)
 
 
 if __name__ == '__main__':
     print("Starting search...", file=sys.stderr)
-    read_en_article_text(find_non_english, parallel=True)
+    read_en_article_text(find_non_english, parallel=True, sharded=True)
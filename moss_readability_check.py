@@ -5,7 +5,8 @@ import re
 import textstat
 import sys
 from moss_dump_analyzer import read_en_article_text
-from wikitext_util import wikitext_to_plaintext, get_main_body_wikitext, ignore_tags_re
+from plaintext_cache import get_plaintext
+from wikitext_util import ignore_tags_re
 
 
 list_cleanup_re = re.compile(r"(^|\n)[ :#\*].*")
@@ -76,8 +77,7 @@ def check_reading_level(article_title, article_text):
     if article_title in article_skip_list:
         return
 
-    article_text = wikitext_to_plaintext(article_text)
-    article_text = get_main_body_wikitext(article_text, strong=True)
+    article_text = get_plaintext(article_text, strong=True)
     article_text = article_text.replace("✂", "")
 
     # Non-prose is out of scope for readability metrics
@@ -125,5 +125,5 @@ def check_reading_level(article_title, article_text):
 
 if __name__ == '__main__':
     print(f"Started at {datetime.datetime.now().isoformat()}", file=sys.stderr)
-    read_en_article_text(check_reading_level, parallel=True)
+    read_en_article_text(check_reading_level, parallel=True, sharded=True)
     print(f"Finished at {datetime.datetime.now().isoformat()}", file=sys.stderr)
@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 
+from itertools import groupby
 import nltk
+from operator import itemgetter
+import os
 import re
+import sys
+from external_sort import merge_runs, remove_runs, spill_run
 from moss_dump_analyzer import read_en_article_text
-from wikitext_util import wikitext_to_plaintext, get_main_body_wikitext, ignore_tags_re
-from spell import is_word_spelled_correctly, bad_words
-from word_categorizer import is_chemistry_word
+from plaintext_cache import get_plaintext
+from record_channels import close_channels, use_channels
+from result_cache import get_files_version
+from wikitext_util import ignore_tags_re
+from spell import classify_words, is_word_spelled_correctly, bad_words, enable_verdict_cache, report_verdict_cache_stats, DICTIONARY_SOURCE_FILES
+from word_categorizer import is_chemistry_word, TITLES_ALL_WIKTIONARIES_FILE, TRANSLITERATIONS_FILE, ENGLISH_WORDS_FILE
 
 
 # TODO:
@@ -47,28 +55,43 @@ from word_categorizer import is_chemistry_word
 #   be pretty solid.
 
 
-misspelled_words = {}
-# Indexes articles by typo.  For example:
-# {'misspellling': (2, ['article1', 'article2'])}
+# Indexes articles by typo, as (word, article title) pairs.  For example:
+# [('misspellling', 'article1'), ('misspellling', 'article2')]
+# To bound memory use on the full dump, pairs are spilled to sorted
+# temporary files (see external_sort.py) when there are more than
+# TYPO_PAIRS_IN_MEMORY.
+TYPO_PAIRS_IN_MEMORY = int(os.environ.get("MOSS_TYPO_PAIRS_IN_MEMORY") or 2000000)
+typo_pairs = []
+typo_runs = []
 
 
 def dump_results():
-    global misspelled_words
-    misspelled_by_freq = [(value[0], key, value[1]) for (key, value) in misspelled_words.items()]
-    misspelled_by_freq = sorted(misspelled_by_freq)
-    for (freq, word, article_list) in misspelled_by_freq:
-        uniq_list = list(set(article_list))
-        uniq_list.sort()
-        uniq_string = ""
-        if uniq_list:
-            uniq_string = u"[[" + u"]], [[".join(uniq_list) + u"]]"
-        output_string = u"* %s - [[wikt:%s]] - %s" % (freq, word, uniq_string)
+    report_verdict_cache_stats()
+
+    # Group pairs by word (merged in sorted order), then sort the
+    # results by frequency, which also may not fit in memory
+    results_by_freq = []
+    results_by_freq_runs = []
+    for (word, pairs) in groupby(merge_runs(typo_pairs, typo_runs), key=itemgetter(0)):
+        article_list = [article_title for (_, article_title) in pairs]
+        uniq_list = [article_title for (article_title, _) in groupby(article_list)]
+        uniq_string = u"[[" + u"]], [[".join(uniq_list) + u"]]"
+        # Zero-padded so frequencies sort numerically
+        results_by_freq.append(("%012d" % len(article_list), word, uniq_string))
+        if len(results_by_freq) >= TYPO_PAIRS_IN_MEMORY:
+            results_by_freq_runs.append(spill_run(results_by_freq))
+
+    for (freq, word, uniq_string) in merge_runs(results_by_freq, results_by_freq_runs):
+        output_string = u"* %s - [[wikt:%s]] - %s" % (int(freq), word, uniq_string)
         print(output_string)
+    remove_runs()
 
 
 start_template_re = re.compile(r"{{")
 end_template_re = re.compile(r"}}")
 unicode_letters_plus_dashes_re = re.compile(r"^([^\W\d_]|-)+$")
+all_caps_re = re.compile(r"^[A-Z]+$")
+all_caps_plural_re = re.compile(r"^[A-Z]+s?$")
 spaced_emdash_re = re.compile(r".{0,10}—\s.{0,10}|.{0,10}\s—.{0,10}")
 newline_re = re.compile(r"\n")
 comma_missing_whitespace_re = re.compile(r"\w+[a-z],\w\w+|\w+\w,[a-zA-Z]\w+")
@@ -144,6 +167,96 @@ def ignore_typo_in_context(word_mixedcase, article_text_orig):
     return False
 
 
+def reassemble_tokens(tokens, article_text):
+    # Reassemble HTML markup and other units the NLTK tokenizer has
+    # split into multiple tokens.  Must double-check against
+    # article_text because the tokenizer ignores whitespace, and we
+    # don't want to accidentally match e.g. where an ampersand in
+    # prose is followed shortly by a semicolon.
+    #
+    # Single pass: each token is extended by consuming the tokens
+    # after it, and only ever compared with the previous output token,
+    # so nothing is deleted from the middle of a list.
+
+    # TODO: Make test cases, especially for beginning and
+    # end-of-document HTML entities.
+    word_list = []
+    i = 0
+    while i < len(tokens):
+        word = tokens[i]
+        i += 1
+        # tokens[i:] are now the tokens following word
+
+        # Two-token sequences
+        if i < len(tokens):
+            # Sometimes tokenization separates final period from the
+            # rest of the acronym.
+            if "." in word and tokens[i] == ".":
+                word += "."
+                i += 1
+
+        # Three-token sequences
+        if i + 1 < len(tokens):
+            if word == "&" and tokens[i + 1] == ";":
+
+                # Protect against & in acronyms, common for railroads
+                # and companies like AT&T, PG&E.
+                if not word_list or not (all_caps_plural_re.match(tokens[i])
+                                         and all_caps_re.match(word_list[-1])):
+                    consolidated = "&%s;" % tokens[i]
+                    if consolidated in article_text:
+                        word = consolidated
+                        i += 2
+
+            elif word == "<" and tokens[i + 1] == ">":
+                consolidated = "<%s>" % tokens[i]
+                if consolidated in article_text:
+                    word = consolidated
+                    i += 2
+
+            # In transliterations from Arabic script (which includes
+            # Persian), NLTK correctly parses U+0027 (apostrophe) and
+            # U+02BE/U+02BF (preferred by the Unicode Consortium and
+            # United Nations).
+            # https://en.wikipedia.org/wiki/Romanization_of_Persian
+            # https://en.wikipedia.org/wiki/Romanization_of_Arabic
+            #
+            # However, Wikipedia allows the use of U+2019 (right
+            # single quote mark) which NLTK will (arguably
+            # justifiably) misparse if used as something other than a
+            # quotation mark.
+            # https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/Persian
+            # https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/Arabic
+            elif tokens[i] == "’":
+                # For example "Āb Anbār-e Pā’īn" must be parsed as three words.
+                if unicode_letters_plus_dashes_re.search(word) and unicode_letters_plus_dashes_re.search(tokens[i + 1]):
+                    word = word + tokens[i] + tokens[i + 1]
+                    i += 2
+
+        # Four-token sequences
+        if i + 2 < len(tokens):
+            if word == "&" and tokens[i] == "#" and tokens[i + 2] == ";":
+                consolidated = "&#%s;" % tokens[i + 1]
+                if consolidated in article_text:
+                    word = consolidated
+                    i += 3
+
+            elif word == "<" and tokens[i] == "/" and tokens[i + 2] == ">":
+                consolidated = "</%s>" % tokens[i + 1]
+                if consolidated in article_text:
+                    word = consolidated
+                    i += 3
+
+            elif word == "<" and tokens[i + 1] == "/" and tokens[i + 2] == ">":
+                consolidated = "<%s/>" % tokens[i]
+                if consolidated in article_text:
+                    word = consolidated
+                    i += 3
+
+        word_list.append(word)
+    return word_list
+
+
 def spellcheck_all_langs_wikt(article_title, article_text):
     return spellcheck_all_langs(article_title, article_text, wiktionary=True)
 
@@ -163,34 +276,35 @@ def spellcheck_all_langs(article_title, article_text, wiktionary=False):
     #     return
 
     if article_title in article_skip_list:
-        print("S\tSKIPPING due to article skip list\t%s" % article_title, flush=True)
+        print("S\tSKIPPING due to article skip list\t%s" % article_title)
         return
 
     if article_title.endswith("(data page)"):
-        print("S\tSKIPPING chemical data page\t%s" % article_title, flush=True)
+        print("S\tSKIPPING chemical data page\t%s" % article_title)
 
     if ignore_tags_re.search(article_text):
-        print("S\tSKIPPING due to known cleanup tag\t%s" % article_title, flush=True)
+        print("S\tSKIPPING due to known cleanup tag\t%s" % article_title)
         return
 
     request_search_string_en = 'title="en:%s"' % article_title
     request_search_string_w = 'title="w:%s"' % article_title
     if request_search_string_en in requested_species_html or request_search_string_w in requested_species_html:
-        print("S\tSKIPPING - list with requested species\t%s" % article_title, flush=True)
+        print("S\tSKIPPING - list with requested species\t%s" % article_title)
         return
 
     # -- Fatal problems --
 
     article_text_orig = article_text
-    article_text = wikitext_to_plaintext(article_text)
-    article_text = get_main_body_wikitext(article_text, wiktionary)
+    # Passed as strong, as the old get_main_body_wikitext(article_text,
+    # wiktionary) call did
+    article_text = get_plaintext(article_text, strong=wiktionary)
 
     # This can break wikitext_to_plaintext() in ways that cause wiki
     # syntax to be mistaken for prose.
     starters = start_template_re.findall(article_text)
     enders = end_template_re.findall(article_text)
     if len(starters) != len(enders):
-        print("!\t* [[%s]] - Mismatched {{ }}" % article_title, flush=True)
+        print("!\t* [[%s]] - Mismatched {{ }}" % article_title)
         return
 
     # -- Dashes --
@@ -203,8 +317,7 @@ def spellcheck_all_langs(article_title, article_text, wiktionary=False):
         print("D\t* %s - [[%s]]: %s" % (
             len(bad_emdash_context_list),
             article_title,
-            " ... ".join(bad_emdash_context_list)),
-              flush=True)
+            " ... ".join(bad_emdash_context_list)))
 
     # -- More fatal problems --
 
@@ -213,9 +326,9 @@ def spellcheck_all_langs(article_title, article_text, wiktionary=False):
             matches = re.findall(r".{0,20}%s.{0,20}" % unmatched_item, article_text)
             excerpt = " ... ".join(matches)
             if unmatched_item == '"' and ("“" in article_text or "”" in article_text):
-                print("!Q\t* [[%s]] - Unmatched %s probably due to violation of [[MOS:STRAIGHT]] near: %s" % (article_title, unmatched_item, excerpt), flush=True)
+                print("!Q\t* [[%s]] - Unmatched %s probably due to violation of [[MOS:STRAIGHT]] near: %s" % (article_title, unmatched_item, excerpt))
             else:
-                print("!\t* [[%s]] - Unmatched %s near: %s" % (article_title, unmatched_item, excerpt), flush=True)
+                print("!\t* [[%s]] - Unmatched %s near: %s" % (article_title, unmatched_item, excerpt))
             # Often due to typo in wiki markup or mismatched English
             # punctuation, but might be due to moss misinterpreting
             # the markup.  (Either way, should be fixed because this
@@ -269,104 +382,12 @@ def spellcheck_all_langs(article_title, article_text, wiktionary=False):
 
     # -- Generate and fix tokenization of word_list --
 
-    word_list = nltk.word_tokenize(article_text.replace("—", " - "))
+    word_list = reassemble_tokens(nltk.word_tokenize(article_text.replace("—", " - ")), article_text)
     # NLTK tokenizer sometimes doesn't split on emdash
 
-    # Old-fashioned loop to allow lookahead and cope with the fact
-    # that the length of word_list may change as it is edited in
-    # place.
-    i = 0
-    while i < len(word_list):
-        # TODO: Make test cases, especially for beginning and
-        # end-of-document HTML entities.
-
-        # Reassemble HTML markup the tokenizer has split into multiple
-        # words.  Must double-check because the tokenizer ignores
-        # whitespace, and we don't want to accidentally match
-        # e.g. where an ampersand in prose is followed shortly by a
-        # semicolon.
-
-        # TODO: Parameterize to avoid code duplication
-
-        # Two-token sequences
-        if i < len(word_list) - 1:
-            # Sometimes tokenization separates final period from the
-            # rest of the acronym.
-            if "." in word_list[i] and word_list[i + 1] == ".":
-                word_list[i] += "."
-                del word_list[i + 1]
-
-        # Three-token sequences
-        if i < len(word_list) - 2:
-            if word_list[i] == "&" and word_list[i + 2] == ";":
-
-                # Protect against & in acronyms, common for railroads
-                # and companies like AT&T, PG&E.
-                if i == 0 or not (re.match("^[A-Z]+s?$", word_list[i + 1])
-                                  and re.match("^[A-Z]+$", word_list[i - 1])):
-                    consolidated = "&%s;" % word_list[i + 1]
-                    if consolidated in article_text:
-                        word_list[i] = consolidated
-                        del word_list[i + 2]
-                        del word_list[i + 1]
-
-            elif word_list[i] == "<" and word_list[i + 2] == ">":
-                consolidated = "<%s>" % word_list[i + 1]
-                if consolidated in article_text:
-                    word_list[i] = consolidated
-                    del word_list[i + 2]
-                    del word_list[i + 1]
-
-            # In transliterations from Arabic script (which includes
-            # Persian), NLTK correctly parses U+0027 (apostrophe) and
-            # U+02BE/U+02BF (preferred by the Unicode Consortium and
-            # United Nations).
-            # https://en.wikipedia.org/wiki/Romanization_of_Persian
-            # https://en.wikipedia.org/wiki/Romanization_of_Arabic
-            #
-            # However, Wikipedia allows the use of U+2019 (right
-            # single quote mark) which NLTK will (arguably
-            # justifiably) misparse if used as something other than a
-            # quotation mark.
-            # https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/Persian
-            # https://en.wikipedia.org/wiki/Wikipedia:Manual_of_Style/Arabic
-            elif word_list[i + 1] == "’":
-                # For example "Āb Anbār-e Pā’īn" must be parsed as three words.
-                if unicode_letters_plus_dashes_re.search(word_list[i]) and unicode_letters_plus_dashes_re.search(word_list[i + 2]):
-                    word_list[i] = word_list[i] + word_list[i + 1] + word_list[i + 2]
-                    del word_list[i + 2]
-                    del word_list[i + 1]
-
-        # Four-token sequences
-        if i < len(word_list) - 3:
-            if word_list[i] == "&" and word_list[i + 1] == "#" and word_list[i + 3] == ";":
-                consolidated = "&#%s;" % word_list[i + 2]
-                if consolidated in article_text:
-                    word_list[i] = consolidated
-                    del word_list[i + 3]
-                    del word_list[i + 2]
-                    del word_list[i + 1]
-
-            elif word_list[i] == "<" and word_list[i + 1] == "/" and word_list[i + 3] == ">":
-                consolidated = "</%s>" % word_list[i + 2]
-                if consolidated in article_text:
-                    word_list[i] = consolidated
-                    del word_list[i + 3]
-                    del word_list[i + 2]
-                    del word_list[i + 1]
-
-            elif word_list[i] == "<" and word_list[i + 2] == "/" and word_list[i + 3] == ">":
-                consolidated = "<%s/>" % word_list[i + 1]
-                if consolidated in article_text:
-                    word_list[i] = consolidated
-                    del word_list[i + 3]
-                    del word_list[i + 2]
-                    del word_list[i + 1]
-
-        i += 1
-
     # -- Main spellcheck loop --
 
+    checked_words = []
     for word_mixedcase in word_list:
 
         # "." is specifically excluded from the below list, due to
@@ -397,11 +418,14 @@ def spellcheck_all_langs(article_title, article_text, wiktionary=False):
             # Let &xxx; pass through un-stripped so it's easy to identify later
             word_mixedcase = word_mixedcase.strip(";")
 
-        is_spelling_correct = is_word_spelled_correctly(word_mixedcase)
+        checked_words.append(word_mixedcase)
+
+    # Each distinct word in the article is only checked once
+    for (word_mixedcase, is_spelling_correct) in zip(checked_words, classify_words(checked_words)):
         if is_spelling_correct is True:
             continue
         if is_spelling_correct == "uncertain":
-            print("G\t%s\t%s" % (word_mixedcase, article_title), flush=True)
+            print("G\t%s\t%s" % (word_mixedcase, article_title))
             # "G" for "iGnored but maybe shouldn't be"
             continue
         if ignore_typo_in_context(word_mixedcase, article_text_orig):
@@ -413,24 +437,43 @@ def spellcheck_all_langs(article_title, article_text, wiktionary=False):
         article_oops_list.append(word_mixedcase)
 
     article_oops_string = u"𝆃".join(article_oops_list)
-    print("@\t%s\t%s\t%s" % (len(article_oops_list), article_title, article_oops_string), flush=True)
+    print("@\t%s\t%s\t%s" % (len(article_oops_list), article_title, article_oops_string))
     return (article_title, article_oops_list)
 
 
 # Callback from completion of spellcheck_all_langs() that indexes
-# articles by typo in a global dictionary in the parent process
+# articles by typo in the parent process
 def tally_misspelled_words(result):
     if not result:
         return
     (article_title, article_oops_list) = result
-    global misspelled_words
     for word_mixedcase in article_oops_list:
-        word_lower = word_mixedcase.lower()
-        (freq, existing_list) = misspelled_words.get(word_lower, (0, []))
-        existing_list.append(article_title)
-        misspelled_words[word_lower] = (len(existing_list), existing_list)
+        typo_pairs.append((word_mixedcase.lower(), article_title))
+    if len(typo_pairs) >= TYPO_PAIRS_IN_MEMORY:
+        typo_runs.append(spill_run(typo_pairs))
+
+
+# Results depend on the dictionaries as well as the code, so any
+# download of new word lists (update_downloads.sh) invalidates the
+# cache of previous results.
+CACHE_DEPENDENCIES = [
+    __file__,
+    sys.modules["spell"].__file__,
+    sys.modules["word_categorizer"].__file__,
+    sys.modules["wikitext_util"].__file__,
+    sys.modules["unencode_entities"].__file__,
+    sys.modules["plaintext_cache"].__file__,
+    sys.modules["word_table"].__file__,
+    TITLES_ALL_WIKTIONARIES_FILE,
+    TRANSLITERATIONS_FILE,
+    ENGLISH_WORDS_FILE,
+] + DICTIONARY_SOURCE_FILES
 
 
 if __name__ == '__main__':
-    read_en_article_text(spellcheck_all_langs, process_result_callback=tally_misspelled_words, parallel=True)
+    use_channels()
+    enable_verdict_cache()
+    read_en_article_text(spellcheck_all_langs, process_result_callback=tally_misspelled_words, parallel=True, sharded=True,
+                         cache_name="spell", cache_version=get_files_version(CACHE_DEPENDENCIES))
     dump_results()
+    close_channels()
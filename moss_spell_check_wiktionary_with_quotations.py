@@ -2,10 +2,16 @@
 
 from moss_dump_analyzer import read_en_article_text
 from moss_spell_check import dump_results, tally_misspelled_words, spellcheck_all_langs
+from record_channels import close_channels, use_channels
+from spell import enable_verdict_cache
 
 if __name__ == '__main__':
+    use_channels()
+    enable_verdict_cache()
     read_en_article_text(spellcheck_all_langs,
                          filename="/var/local/moss/bulk-wikipedia/enwiktionary-articles-no-redir.csv",
                          process_result_callback=tally_misspelled_words,
-                         parallel=True)
+                         parallel=True,
+                         sharded=True)
     dump_results()
+    close_channels()
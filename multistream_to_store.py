@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# Converts a pages-articles-multistream.xml.bz2 dump directly to the
+# article store (see article_store.py), without writing the
+# decompressed XML to disk.
+#
+# A multistream dump is a concatenation of independent bz2 streams of
+# about 100 pages each, so groups of streams can be decompressed and
+# parsed in parallel worker processes.  Stream offsets are read from
+# the matching multistream-index.txt.bz2 file if one is given;
+# otherwise the dump is scanned for bz2 stream headers.
+
+# USAGE:
+#  multistream_to_store.py dump.xml.bz2 articles.bin [dump-index.txt.bz2]
+
+import bz2
+from collections import deque
+import datetime
+from io import BytesIO
+import lxml.etree
+from multiprocessing import Pool
+import os
+import re
+import sys
+from article_store import get_page_text, write_article_store
+from moss_dump_analyzer import BATCHES_IN_FLIGHT_PER_WORKER, get_worker_count
+
+STREAMS_PER_TASK = 20
+SCAN_READ_SIZE = 64 * 1024 * 1024
+
+# "BZh", block size, then the block header magic number (pi), which is
+# byte-aligned only at the start of a stream.
+STREAM_HEADER_RE = re.compile(rb"BZh[1-9]1AY&SY")
+STREAM_HEADER_LENGTH = 10
+
+
+def get_stream_offsets_from_index(index_filename):
+    # Index lines are "offset:page id:title"
+    offsets = set()
+    with bz2.open(index_filename, "rt") as index_file:
+        for line in index_file:
+            offsets.add(int(line.split(":", 1)[0]))
+    return sorted(offsets)
+
+
+def get_stream_offsets_by_scan(dump_filename):
+    offsets = []
+    with open(dump_filename, "rb") as dump_file:
+        chunk_start = 0
+        overlap = b""
+        while True:
+            chunk = dump_file.read(SCAN_READ_SIZE)
+            if not chunk:
+                break
+            data = overlap + chunk
+            data_start = chunk_start - len(overlap)
+            for match in STREAM_HEADER_RE.finditer(data):
+                offset = data_start + match.start()
+                if not offsets or offset > offsets[-1]:
+                    offsets.append(offset)
+            overlap = data[-(STREAM_HEADER_LENGTH - 1):]
+            chunk_start += len(chunk)
+    return offsets
+
+
+def parse_pages(xml_bytes):
+    # xml_bytes is a run of complete <page> elements, possibly with the
+    # <mediawiki> header or footer around them.  Returns a list of
+    # (article_title, article_text) for non-redirect articles.
+    first_page = xml_bytes.find(b"<page>")
+    last_page_end = xml_bytes.rfind(b"</page>")
+    if first_page == -1 or last_page_end == -1:
+        return []
+    xml_bytes = b"<pages>" + xml_bytes[first_page:last_page_end + len(b"</page>")] + b"</pages>"
+
+    pages = []
+    for (_, page_element) in lxml.etree.iterparse(BytesIO(xml_bytes), events=("end",), tag="page"):
+        if page_element.findtext("ns") == "0" and page_element.find("redirect") is None:
+            article_title = page_element.findtext("title")
+            article_text = get_page_text(page_element)
+            pages.append((article_title, article_text))
+
+        # Free memory for pages already processed
+        page_element.clear()
+        while page_element.getprevious() is not None:
+            del page_element.getparent()[0]
+    return pages
+
+
+def convert_streams(task):
+    (dump_filename, start, end) = task
+    with open(dump_filename, "rb") as dump_file:
+        dump_file.seek(start)
+        compressed = dump_file.read(end - start)
+    # bz2.decompress() handles multiple concatenated streams
+    return parse_pages(bz2.decompress(compressed))
+
+
+def multistream_page_generator(dump_filename, stream_offsets, workers=None):
+    stream_offsets = stream_offsets + [os.path.getsize(dump_filename)]
+    tasks = [(dump_filename, stream_offsets[i], stream_offsets[min(i + STREAMS_PER_TASK, len(stream_offsets) - 1)])
+             for i in range(0, len(stream_offsets) - 1, STREAMS_PER_TASK)]
+    workers = get_worker_count(workers)
+    task_number = 0
+    in_flight = deque()
+
+    def yield_oldest():
+        # Results are yielded in dump order
+        nonlocal task_number
+        pages = in_flight.popleft().get()
+        task_number += 1
+        if task_number % 1000 == 0:
+            print(f"Converted {task_number}/{len(tasks)} stream groups - "
+                  + str(datetime.datetime.now().isoformat()),
+                  file=sys.stderr)
+        return pages
+
+    with Pool(workers) as pool:
+        for task in tasks:
+            if len(in_flight) >= workers * BATCHES_IN_FLIGHT_PER_WORKER:
+                # Don't parse further ahead than this, so parsed pages
+                # don't pile up in memory while the store is written
+                yield from yield_oldest()
+            in_flight.append(pool.apply_async(convert_streams, args=[task]))
+        while in_flight:
+            yield from yield_oldest()
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in [3, 4]:
+        print("Usage: multistream_to_store.py dump.xml.bz2 articles.bin [dump-index.txt.bz2]")
+        exit(1)
+    dump_filename = sys.argv[1]
+    store_filename = sys.argv[2]
+
+    if len(sys.argv) == 4:
+        stream_offsets = get_stream_offsets_from_index(sys.argv[3])
+    else:
+        stream_offsets = get_stream_offsets_by_scan(dump_filename)
+    print(f"Found {len(stream_offsets)} bz2 streams", file=sys.stderr)
+
+    count = write_article_store(store_filename, multistream_page_generator(dump_filename, stream_offsets))
+    print(f"Wrote {count} articles to {store_filename}", file=sys.stderr)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# Counts how many times each of a large, fixed list of strings
+# ("needles") occurs in a text, as str.count() would, without scanning
+# the text once per needle.
+#
+# Almost all of the needles used by moss_entity_check.py contain a
+# non-ASCII character, and most articles contain only a few distinct
+# non-ASCII characters.  So each needle is keyed by its first
+# non-ASCII character (or, for all-ASCII needles, by one of the
+# uncommon MARKER_CHARS), the text's non-ASCII and marker characters
+# are tallied in one pass (tally_chars()), and only needles whose key
+# is present are looked at: single characters are answered from the
+# tally, and longer needles are counted with str.count().  All-ASCII
+# needles without a marker character are always counted with
+# str.count().
+
+from collections import Counter, defaultdict
+import re
+
+non_ascii_re = re.compile(r"[^\x00-\x7f]+")
+ascii_bytes = bytes(range(128))
+
+# ASCII characters that are uncommon enough in articles to be worth
+# looking for
+MARKER_CHARS = "&<`"
+
+
+def get_needle_key(needle):
+    match = non_ascii_re.search(needle)
+    if match:
+        return match.group()[0]
+    for char in needle:
+        if char in MARKER_CHARS:
+            return char
+    return None
+
+
+def make_needle_counter(needles):
+    unkeyed_needles = []
+    needles_by_char = defaultdict(list)
+    for (index, needle) in enumerate(needles):
+        key = get_needle_key(needle)
+        if key:
+            needles_by_char[key].append((index, needle))
+        else:
+            unkeyed_needles.append((index, needle))
+    return (unkeyed_needles, dict(needles_by_char))
+
+
+def get_non_ascii_chars(text):
+    # The non-ASCII characters of text, in order.  Deleting the ASCII
+    # bytes from the UTF-8 encoding is several times faster than
+    # non_ascii_re.findall(); ASCII bytes are never part of a
+    # multi-byte character.
+    if text.isascii():
+        return ""
+    return text.encode("utf-8", "surrogatepass").translate(None, ascii_bytes).decode("utf-8", "surrogatepass")
+
+
+def tally_chars(text):
+    # Counts of each distinct non-ASCII character in text, and of the
+    # MARKER_CHARS it contains
+    char_counts = Counter(get_non_ascii_chars(text))
+    for char in MARKER_CHARS:
+        count = text.count(char)
+        if count:
+            char_counts[char] = count
+    return char_counts
+
+
+def may_contain_needles(needle_counter, char_counts):
+    # False if text with this tally can't contain any of the needles
+    (unkeyed_needles, needles_by_char) = needle_counter
+    return bool(unkeyed_needles) or not char_counts.keys().isdisjoint(needles_by_char.keys())
+
+
+def count_needles(needle_counter, text, char_counts=None):
+    # Returns a list of (needle, count) for the needles found in text,
+    # in the order they were given to make_needle_counter().
+    # char_counts is tally_chars(text), if already known.
+    (unkeyed_needles, needles_by_char) = needle_counter
+    if char_counts is None:
+        char_counts = tally_chars(text)
+
+    found = []
+    for (index, needle) in unkeyed_needles:
+        count = text.count(needle)
+        if count:
+            found.append((index, needle, count))
+
+    for char in char_counts.keys() & needles_by_char.keys():
+        for (index, needle) in needles_by_char[char]:
+            if len(needle) == 1:
+                count = char_counts[char]
+            else:
+                count = text.count(needle)
+            if count:
+                found.append((index, needle, count))
+
+    found.sort()
+    return [(needle, count) for (_, needle, count) in found]
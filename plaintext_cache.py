@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# Shared cache of the plaintext versions of each article, so the
+# reports that need them (moss_spell_check.py, moss_not_english.py,
+# moss_readability_check.py, chemical_formula_report.py) don't each
+# run wikitext_to_plaintext() and get_main_body_wikitext() on every
+# article in the dump.
+#
+# Build the cache once per dump, before running the reports:
+#
+#   python3 plaintext_cache.py [article file]
+#
+# Entries are keyed by a digest of the article text, and hold every
+# variant in PLAINTEXT_VARIANTS.  Reports call get_plaintext() instead
+# of the two wikitext_util functions; it uses the cache if there is
+# one for the current version of wikitext_util.py, and otherwise (or
+# for articles or variants that aren't cached) computes the text as
+# before, so the results are always the same.
+#
+# The cache file defaults to the one next to the article file being
+# read by read_en_article_text() (or the default article file), so
+# reports on other dumps don't look up articles in the wrong cache;
+# set MOSS_PLAINTEXT_CACHE to use a different file, or to "" to not
+# use one.  Rebuilding reuses the entries of unchanged articles.
+
+from functools import partial
+import os
+import pickle
+import sqlite3
+import sys
+import zlib
+import moss_dump_analyzer
+from moss_dump_analyzer import get_default_filename, read_en_article_text
+from result_cache import digest_text, get_cache_filename, get_files_version
+from wikitext_util import get_main_body_wikitext, wikitext_to_plaintext
+
+# (flatten_sup_sub, strong, wiktionary) as used by the reports.  The
+# Wiktionary spell check uses the strong variant.
+PLAINTEXT_VARIANTS = [
+    (True, False, False),
+    (True, True, False),
+    (False, False, False),
+]
+
+PLAINTEXT_VERSION = get_files_version([__file__, sys.modules["wikitext_util"].__file__], extra=repr(PLAINTEXT_VARIANTS))
+
+# Per-process state: the cache connection (None if there is no usable
+# cache, False if not opened yet) and its filename, and the variants of
+# the most recent article, so asking for several variants of the same
+# article only looks it up once
+plaintext_connection = False
+plaintext_connection_filename = None
+current_digest = None
+current_texts = {}
+
+
+def get_plaintext_cache_filename():
+    filename = os.environ.get("MOSS_PLAINTEXT_CACHE")
+    if filename is None:
+        filename = get_cache_filename(moss_dump_analyzer.article_filename or get_default_filename(), "plaintext")
+    return filename
+
+
+def open_plaintext_cache(cache_filename):
+    # Read-only; returns None if there is no cache for this version
+    if not cache_filename or not os.path.exists(cache_filename):
+        return None
+    connection = sqlite3.connect(f"file:{cache_filename}?mode=ro", uri=True)
+    row = connection.execute("SELECT value FROM metadata WHERE key = 'version'").fetchone()
+    if not row or row[0] != PLAINTEXT_VERSION:
+        connection.close()
+        return None
+    return connection
+
+
+def lookup_plaintext_entry(connection, digest):
+    row = connection.execute("SELECT entry FROM plaintext WHERE digest = ?", [digest]).fetchone()
+    if row:
+        return row[0]
+    return None
+
+
+def make_plaintext_entry(article_text):
+    # Compressed pickle of the text of each variant, in
+    # PLAINTEXT_VARIANTS order.  Variants are often identical, so
+    # identical texts are made the same object, which pickle stores
+    # once.
+    plaintexts = {}
+    unique_texts = {}
+    texts = []
+    for (flatten_sup_sub, strong, wiktionary) in PLAINTEXT_VARIANTS:
+        if flatten_sup_sub not in plaintexts:
+            plaintexts[flatten_sup_sub] = wikitext_to_plaintext(article_text, flatten_sup_sub=flatten_sup_sub)
+        text = get_main_body_wikitext(plaintexts[flatten_sup_sub], strong, wiktionary)
+        texts.append(unique_texts.setdefault(text, text))
+    return zlib.compress(pickle.dumps(texts), 1)
+
+
+def read_plaintext_entry(entry):
+    return dict(zip(PLAINTEXT_VARIANTS, pickle.loads(zlib.decompress(entry))))
+
+
+def get_plaintext(article_text, flatten_sup_sub=True, strong=False, wiktionary=False):
+    # Same as get_main_body_wikitext(wikitext_to_plaintext(article_text,
+    # flatten_sup_sub), strong, wiktionary)
+    global plaintext_connection, plaintext_connection_filename, current_digest, current_texts
+    cache_filename = get_plaintext_cache_filename()
+    if plaintext_connection is False or cache_filename != plaintext_connection_filename:
+        if plaintext_connection:
+            plaintext_connection.close()
+        plaintext_connection = open_plaintext_cache(cache_filename)
+        plaintext_connection_filename = cache_filename
+        current_digest = None
+
+    variant = (flatten_sup_sub, strong, wiktionary)
+    if plaintext_connection and variant in PLAINTEXT_VARIANTS:
+        digest = digest_text(article_text)
+        if digest != current_digest:
+            entry = lookup_plaintext_entry(plaintext_connection, digest)
+            current_digest = digest
+            current_texts = read_plaintext_entry(entry) if entry else {}
+        if variant in current_texts:
+            return current_texts[variant]
+
+    return get_main_body_wikitext(wikitext_to_plaintext(article_text, flatten_sup_sub=flatten_sup_sub), strong, wiktionary)
+
+
+# --- Building the cache ---
+
+old_connection = False
+
+
+def build_plaintext_entry(old_cache_filename, article_title, article_text):
+    # Runs in worker processes; reuses the entry from the previous
+    # cache if the article hasn't changed
+    global old_connection
+    if old_connection is False:
+        old_connection = open_plaintext_cache(old_cache_filename)
+    digest = digest_text(article_text)
+    entry = None
+    if old_connection:
+        entry = lookup_plaintext_entry(old_connection, digest)
+    if entry is None:
+        entry = make_plaintext_entry(article_text)
+    return (digest, entry)
+
+
+def build_plaintext_cache(filename, cache_filename):
+    new_filename = cache_filename + ".new"
+    if os.path.exists(new_filename):
+        os.remove(new_filename)
+    connection = sqlite3.connect(new_filename, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+    connection.execute("CREATE TABLE plaintext (digest BLOB PRIMARY KEY, entry BLOB)")
+    connection.execute("INSERT INTO metadata VALUES ('version', ?)", [PLAINTEXT_VERSION])
+
+    def add_plaintext_entry(result):
+        connection.execute("INSERT OR IGNORE INTO plaintext VALUES (?, ?)", result)
+
+    read_en_article_text(partial(build_plaintext_entry, cache_filename), filename,
+                         process_result_callback=add_plaintext_entry, parallel=True, sharded=True)
+    connection.commit()
+    connection.close()
+    os.replace(new_filename, cache_filename)
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if sys.argv[1:] else get_default_filename()
+    cache_filename = os.environ.get("MOSS_PLAINTEXT_CACHE") or get_cache_filename(filename, "plaintext")
+    print(f"Building plaintext cache {cache_filename} from {filename}", file=sys.stderr)
+    build_plaintext_cache(filename, cache_filename)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Splits the spellcheck output stream into one file ("channel") per
+# record type, so post-processing can read just the records it needs
+# instead of grepping the whole multi-gigabyte output several times.
+#
+# Records are the output lines of moss_spell_check.py, identified by
+# the field before the first tab ("@", "G", "D", "!", "!Q", "S"), or
+# "*" for the typo index from dump_results().  Lines are written to
+# the channel files unchanged, so each file has the same contents as
+# grepping the combined output for that record type.
+#
+# Install with use_channels() before starting the worker pool; forked
+# workers inherit the open files.  Writes are buffered, and each write
+# to a file contains only complete lines and is appended atomically,
+# so lines from different processes don't get mixed together.
+
+from collections import defaultdict
+import io
+import os
+import sys
+
+CHANNEL_FILES = {
+    "@": "articles.txt",
+    "G": "ignored.txt",
+    "D": "dashes.txt",
+    "!": "parse-failures.txt",
+    "!Q": "straight-quotes.txt",
+    "S": "skipped.txt",
+    "*": "typos.txt",
+    # Anything else
+    "": "other.txt",
+}
+
+# Characters buffered before writing to the channel files
+CHANNEL_BUFFER_SIZE = 1024 * 1024
+
+
+def get_channel(line):
+    if line.startswith("*"):
+        return "*"
+    record_type = line.split("\t", 1)[0]
+    if record_type in CHANNEL_FILES:
+        return record_type
+    return ""
+
+
+def write_all(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+class ChannelWriter(io.TextIOBase):
+    # Replacement for sys.stdout that sorts lines into channel files
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        # Opened (and emptied) once, up front, so worker processes
+        # append to the same files
+        self.fds = {channel: os.open(os.path.join(directory, filename), os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+                    for (channel, filename) in CHANNEL_FILES.items()}
+        self.buffers = defaultdict(list)
+        self.buffered_size = 0
+        self.partial_line = ""
+
+    def write(self, text):
+        lines = (self.partial_line + text).split("\n")
+        self.partial_line = lines.pop()
+        for line in lines:
+            self.buffers[get_channel(line)].append(line + "\n")
+            self.buffered_size += len(line) + 1
+        if self.buffered_size >= CHANNEL_BUFFER_SIZE:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        for (channel, lines) in self.buffers.items():
+            write_all(self.fds[channel], "".join(lines).encode("utf-8"))
+        self.buffers.clear()
+        self.buffered_size = 0
+
+    def close(self):
+        if self.partial_line:
+            self.write("\n")
+        self.flush()
+        for fd in self.fds.values():
+            os.close(fd)
+        super().close()
+
+
+def use_channels():
+    # If MOSS_SPELL_CHANNELS is set to a directory, send standard
+    # output to channel files there
+    directory = os.environ.get("MOSS_SPELL_CHANNELS")
+    if directory:
+        print(f"Writing output to channel files in {directory}", file=sys.stderr)
+        sys.stdout = ChannelWriter(directory)
+
+
+def close_channels():
+    if isinstance(sys.stdout, ChannelWriter):
+        sys.stdout.close()
+        sys.stdout = sys.__stdout__
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Per-report cache of callback results, keyed by article title and a
+# digest of the article text, so unchanged articles can be replayed
+# instead of recomputed.  See read_en_article_text(cache_name=...).
+#
+# Each report has its own SQLite file next to the article file.  The
+# cache also records a version string (typically a digest of the
+# report's source code and data files, see get_files_version()); if
+# the version changes, the old cache is ignored.  Each run writes a
+# complete new cache, which replaces the old one when the run
+# finishes, so deleted articles drop out.
+#
+# Set MOSS_NO_CACHE=1 to ignore the existing cache (a fresh one is
+# still written).
+
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+import sqlite3
+import sys
+
+# Open read-only connections in each worker process, by cache filename
+worker_connections = {}
+
+
+def get_cache_filename(filename, cache_name):
+    return f"{filename}.{cache_name}-cache.sqlite"
+
+
+def digest_text(article_text):
+    return hashlib.blake2b(article_text.encode("utf-8"), digest_size=16).digest()
+
+
+def get_files_version(filenames, extra=""):
+    # Changes whenever any of the given files (source code or data the
+    # report depends on) is modified.  Uses size and modification time
+    # since some of the data files are several gigabytes.
+    version_hash = hashlib.blake2b(extra.encode("utf-8"), digest_size=16)
+    for filename in filenames:
+        stat = os.stat(filename)
+        version_hash.update(f"{os.path.abspath(filename)}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode("utf-8"))
+    return version_hash.hexdigest()
+
+
+def open_cache_for_reading(cache_filename, cache_version):
+    if os.environ.get("MOSS_NO_CACHE") or not os.path.exists(cache_filename):
+        return None
+    connection = sqlite3.connect(f"file:{cache_filename}?mode=ro", uri=True)
+    row = connection.execute("SELECT value FROM metadata WHERE key = 'version'").fetchone()
+    if not row or row[0] != cache_version:
+        connection.close()
+        return None
+    return connection
+
+
+def create_cache(cache_filename, cache_version):
+    new_filename = cache_filename + ".new"
+    if os.path.exists(new_filename):
+        os.remove(new_filename)
+    # Written from the pool's result handler thread
+    connection = sqlite3.connect(new_filename, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+    connection.execute("CREATE TABLE results (title TEXT PRIMARY KEY, digest BLOB, entry BLOB)")
+    connection.execute("INSERT INTO metadata VALUES ('version', ?)", [cache_version])
+    return connection
+
+
+def add_entry(connection, article_title, digest, output, result):
+    connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                       [article_title, digest, pickle.dumps((output, result))])
+
+
+def finish_cache(connection, cache_filename):
+    connection.commit()
+    connection.close()
+    os.replace(cache_filename + ".new", cache_filename)
+
+
+def lookup_entry(connection, article_title, digest):
+    # Returns (output, result) if article_title was cached with the
+    # same text, otherwise None
+    row = connection.execute("SELECT digest, entry FROM results WHERE title = ?", [article_title]).fetchone()
+    if row and row[0] == digest:
+        return pickle.loads(row[1])
+    return None
+
+
+def cached_callback(callback_function, cache_filename, cache_version, article_title, article_text):
+    # Wraps a report callback (via functools.partial) in worker
+    # processes.  Anything the callback prints is captured and returned
+    # along with its result, so both can be cached and the parent
+    # process can write the output.
+    if cache_filename not in worker_connections:
+        worker_connections[cache_filename] = open_cache_for_reading(cache_filename, cache_version)
+    connection = worker_connections[cache_filename]
+
+    digest = digest_text(article_text)
+    cached = None
+    if connection:
+        cached = lookup_entry(connection, article_title, digest)
+    if cached:
+        (output, result) = cached
+        return (article_title, digest, output, result, True)
+
+    output_buffer = io.StringIO()
+    with contextlib.redirect_stdout(output_buffer):
+        result = callback_function(article_title, article_text)
+    return (article_title, digest, output_buffer.getvalue(), result, False)
+
+
+def make_cache_result_callback(connection, process_result_callback, stats):
+    # Runs in the parent process on each value returned by
+    # cached_callback(): records it in the new cache, writes any
+    # captured output, and passes the report's own result on.
+    # stats counts [misses, hits].
+    def process_cache_entry(entry):
+        (article_title, digest, output, result, hit) = entry
+        add_entry(connection, article_title, digest, output, result)
+        stats[hit] += 1
+        if output:
+            sys.stdout.write(output)
+        if result is not None:
+            process_result_callback(result)
+    return process_cache_entry
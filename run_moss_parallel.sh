@@ -29,6 +29,27 @@ echo `date`
 cat tmp-entities | ../venv/bin/python3 ../summarizer.py --find-all > post-entities.txt
 
 
+# --- SPELLCHECK DICTIONARY ---
+
+# Precompile the word lists once so every spellcheck process below
+# maps the same file instead of re-reading them at startup.
+
+echo "Building spellcheck dictionary"
+echo `date`
+../venv/bin/python3 ../spell.py --build-dictionary
+
+
+# --- PLAINTEXT CACHE ---
+
+# Convert each article to the plaintext variants used by the spelling,
+# not-English, readability and chemical formula reports once, instead
+# of once per report (see plaintext_cache.py).
+
+echo "Building plaintext cache"
+echo `date`
+../venv/bin/python3 ../plaintext_cache.py
+
+
 # --- PARALLELIZED REPORTS ---
 
 # Run multiple main threads because even though most calculations are
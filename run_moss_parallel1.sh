@@ -7,35 +7,46 @@ set -e
 
 export NON_ASCII_LETTERS=ậạàÁáÂâÃãÄäầåấæɑ̠āÇçÈèÉéÊêËëēÌìÍíÎîÏïĭǐīʝÑñÒòÓóÔôÕõÖöớộøōŠšÚúùÙÛûǚÜüũưụÝýŸÿŽžəþɛ
 
+# --- SINGLE-PASS DUMP SCAN ---
+
+# Every full-dump regex search used by the reports below, done in one
+# pass instead of one pass per regex with dump_grep_csv.py.  Regexes
+# and output files (tmp-grep-*.txt, etc.) are listed in
+# dump_grep_manifest1.tsv.
+
+echo "Starting single-pass dump scan"
+echo `date`
+../venv/bin/python3 ../dump_grep_multi.py ../dump_grep_manifest1.tsv
+
 # --- l TO L FOR LITERS ---
 echo "Starting liters style check"
 echo `date`
 
 # Per April 2021 RFC that updated [[MOS:UNITSYMBOLS]]
 
-# Run time: 9-22 min per regex
+# Run time: 9-22 min per regex (before single-pass scan)
 
 # For "(l)", "(l/c/d)", etc. in table headers
-../venv/bin/python3 ../dump_grep_csv.py '\(l(/[a-zA-Z/]+)?\)' | grep -v '(l)\!' | grep -v '(r)' | grep -vP "[a-zA-Z${NON_ASCII_LETTERS}]\(l\)" | grep -vP "\(l\)[a-zA-Z${NON_ASCII_LETTERS}]" | grep -vP '</?math' | sort > tmp-liters-fixme0.txt
+cat tmp-grep-liters0.txt | grep -v '(l)\!' | grep -v '(r)' | grep -vP "[a-zA-Z${NON_ASCII_LETTERS}]\(l\)" | grep -vP "\(l\)[a-zA-Z${NON_ASCII_LETTERS}]" | grep -vP '</?math' | sort > tmp-liters-fixme0.txt
 
-../venv/bin/python3 ../dump_grep_csv.py "[0-9] l" | perl -pe "s%\{\{cite.*?\}\}%%g" | perl -pe "s%\{\{(Transliteration|lang|IPA|not a typo).*?\}\}%%g" | perl -pe "s%<math.*?</math>%%g" | perl -pe "s/(File|Image):.*?[\|\n]//g" | grep -P "[^p][^.]\s?[0-9]+ l[^a-zA-Z0-9'’${NON_ASCII_LETTERS}]" | grep -vi " l.jpg" | grep -vP "image[0-9]? *=.* l[ \.].jpg" | grep -v "AD-1 l" | grep -v "l=" | grep -v "\[\[Pound sterling|l" | grep -v "{{not English inline}}" | sort > tmp-liters-fixme1.txt
+cat tmp-grep-liters1.txt | perl -pe "s%\{\{cite.*?\}\}%%g" | perl -pe "s%\{\{(Transliteration|lang|IPA|not a typo).*?\}\}%%g" | perl -pe "s%<math.*?</math>%%g" | perl -pe "s/(File|Image):.*?[\|\n]//g" | grep -P "[^p][^.]\s?[0-9]+ l[^a-zA-Z0-9'’${NON_ASCII_LETTERS}]" | grep -vi " l.jpg" | grep -vP "image[0-9]? *=.* l[ \.].jpg" | grep -v "AD-1 l" | grep -v "l=" | grep -v "\[\[Pound sterling|l" | grep -v "{{not English inline}}" | sort > tmp-liters-fixme1.txt
 
-../venv/bin/python3 ../dump_grep_csv.py "[rBbMm]illion l[^a-zA-Z0-9']" | sort > tmp-liters-fixme2.txt
+cat tmp-grep-liters2.txt | sort > tmp-liters-fixme2.txt
 
-../venv/bin/python3 ../dump_grep_csv.py '([Ll]iter|[Ll]itre)s?\|l]]'| perl -pe "s%\{\{cite.*?\}\}%%g" | sort > tmp-liters-fixme3.txt
+cat tmp-grep-liters3.txt | perl -pe "s%\{\{cite.*?\}\}%%g" | sort > tmp-liters-fixme3.txt
 
-../venv/bin/python3 ../dump_grep_csv.py "[0-9]&nbsp;l[^A-Za-z'0-9]" | sort > tmp-liters-fixme4.txt
+cat tmp-grep-liters4.txt | sort > tmp-liters-fixme4.txt
 
-../venv/bin/python3 ../dump_grep_csv.py "/l" | perl -pe "s/{{not a typo.*?}}//" | perl -pe "s/{{math.*?}}//" | perl -pe "s%<math>.*?</math>%%g" | perl -pe "s/(File|Image):.*?\|//g" | grep -P "[^A-Za-z\./][A-Za-z]{1,4}/l[^a-zA-Z${NON_ASCII_LETTERS}'0-9/\-_]" | grep -vP "w/l(-[0-9])? *=" | grep -vP "(https?://|data:)[A-Za-z0-9_\-\./,\+%~;]+/l[^a-zA-Z'’]" | grep -vP "[^a-zA-Z0-9]r/l" | grep -vP "[^a-zA-Z0-9]d/l[^a-zA-Z0-9]" | grep -vP "\[\[(\w+ )+a/l [\w ]+\]\]" | grep -vP "\{\{cite.{5,100} a/l .{5,100}\}\}" | grep -v "Malaysian names#Indian names|a/l" | grep -vP "Length at the waterline\|(Length )?w/l" | grep -v "Waterline length|w/l" | sort > tmp-liters-fixme5.txt
+cat tmp-grep-liters5.txt | perl -pe "s/{{not a typo.*?}}//" | perl -pe "s/{{math.*?}}//" | perl -pe "s%<math>.*?</math>%%g" | perl -pe "s/(File|Image):.*?\|//g" | grep -P "[^A-Za-z\./][A-Za-z]{1,4}/l[^a-zA-Z${NON_ASCII_LETTERS}'0-9/\-_]" | grep -vP "w/l(-[0-9])? *=" | grep -vP "(https?://|data:)[A-Za-z0-9_\-\./,\+%~;]+/l[^a-zA-Z'’]" | grep -vP "[^a-zA-Z0-9]r/l" | grep -vP "[^a-zA-Z0-9]d/l[^a-zA-Z0-9]" | grep -vP "\[\[(\w+ )+a/l [\w ]+\]\]" | grep -vP "\{\{cite.{5,100} a/l .{5,100}\}\}" | grep -v "Malaysian names#Indian names|a/l" | grep -vP "Length at the waterline\|(Length )?w/l" | grep -v "Waterline length|w/l" | sort > tmp-liters-fixme5.txt
 # Done for fixme5:
 # expand "m/l" to "music and lyrics" or drop
 # expand "w/l" to "win/loss"
 # expand "s/l" to "sideline" "l/b" to "sideline" (line ball)
 # change "a/l" to "[[Malaysian names#Indian names|a/l]]" except inside internal or external links
 
-../venv/bin/python3 ../dump_grep_csv.py '{{(convert|cvt)\|[^\}]+\|l(\||}|/)' | sort > tmp-liters-fixme6.txt
+cat tmp-grep-liters6.txt | sort > tmp-liters-fixme6.txt
 
-../venv/bin/python3 ../dump_grep_csv.py ' [0-9,\.]+( |&nbsp;)?l/[a-zA-Z0-9]' | sort > tmp-liters-fixme7.txt
+cat tmp-grep-liters7.txt | sort > tmp-liters-fixme7.txt
 
 cat tmp-liters-fixme* | perl -pe 's/(.*?):.+/$1/' | uniq > liters-all.txt
 
@@ -44,8 +55,8 @@ cat tmp-liters-fixme* | perl -pe 's/(.*?):.+/$1/' | uniq > liters-all.txt
 echo "Starting x-to-times"
 echo `date`
 
-../venv/bin/python3 ../dump_grep_csv.py '[0-9]x[^a-zA-Z]' | perl -pe 's/\[\[(File|Image):.*?\]\]//' | perl -pe s'/\| *image[0-9]? *=$//' | perl -pe 's/https?:.*? //' | grep -vP '[a-zA-Z\-_][0-9]+x' | grep -vP 'x[a-zA-Z]' | grep -vP '( 4x4 | 6x6 )' | grep -vP '[0-9]+x[0-9]+px' | grep -v '<math' | grep -vP '[^0-9]0x[0-9]+' | grep -P '[0-9]+x[0-9]*' | perl -pe 's/:.*$//' | uniq | sort > x-correct-nospace-with-article.txt
-../venv/bin/python3 ../dump_grep_csv.py " x " | perl -pe 's/:.*$//' | uniq | sort > x-correct-space-with-article.txt
+cat tmp-grep-x-nospace.txt | perl -pe 's/\[\[(File|Image):.*?\]\]//' | perl -pe s'/\| *image[0-9]? *=$//' | perl -pe 's/https?:.*? //' | grep -vP '[a-zA-Z\-_][0-9]+x' | grep -vP 'x[a-zA-Z]' | grep -vP '( 4x4 | 6x6 )' | grep -vP '[0-9]+x[0-9]+px' | grep -v '<math' | grep -vP '[^0-9]0x[0-9]+' | grep -P '[0-9]+x[0-9]*' | perl -pe 's/:.*$//' | uniq | sort > x-correct-nospace-with-article.txt
+cat tmp-grep-x-space.txt | perl -pe 's/:.*$//' | uniq | sort > x-correct-space-with-article.txt
 
 # --- RHYME SCHEMES ---
 
@@ -83,20 +94,19 @@ echo `date`
 
 echo "  Beginning F scan..."
 echo `date`
-../venv/bin/python3 ../dump_grep_csv.py F | grep -P "(°F|0s( |&nbsp;)F[^b-z])" > tmp-temp-F.txt
+cat tmp-grep-temp-F.txt | grep -P "(°F|0s( |&nbsp;)F[^b-z])" > tmp-temp-F.txt
 
 grep '°F' tmp-temp-F.txt | perl -pe "s/\{\{([Cc]onvert|[Cc]vt).*?\}\}//g" | grep -vP '°C.{0,30}°F' | grep -vP '°F.{0,30}°C' | grep -vP "(min|max|mean)_temp_[0-9]" | grep "°F" | sort > tmp-temperature-convert1.txt
 grep "[0-9]0s( |&nbsp;)?F[^b-z]" tmp-temp-F.txt | grep -vP "[0-9]{3}0s" | perl -pe "s%<ref.*?</ref>%%g" | grep -v "Celsius" | grep "0s" | sort > tmp-temperature-convert5.txt
 
 echo "  Beginning weather scan..."
 echo `date`
-../venv/bin/python3 ../dump_grep_csv.py "([Ww]eather|WEATHER|[Tt]emperature|TEMPERATURE|[Hh]eat|HEAT|[Cc]hill|CHILL)" > tmp-temp-weather.txt
 
 grep '[ \(][0-9](C|F)[^a-zA-Z0-9]' tmp-temp-weather.txt | sort > tmp-temperature-convert2.txt
 grep "[0-9]+s?( |&nbsp;)(C|F)[^a-zA-Z0-9]" tmp-temp-weather.txt | sort > tmp-temperature-convert3.txt
 grep '[0-9]°' tmp-temp-weather.txt | sort > tmp-temperature-convert4b.txt
 grep '[0-9][0-9],' tmp-temp-weather.txt | grep -iP "weather=" | sort > tmp-temperature-convert4c.txt
-../venv/bin/python3 ../dump_grep_csv.py "(low|lower|mid|middle|high|upper|the)[ \-][0-9][0-9]?0s" | perl -pe "s%<ref.*?</ref>%%g" | grep -v "Celsius" | grep "0s" | sort > tmp-temperature-convert6.txt
+cat tmp-grep-temp-decades.txt | perl -pe "s%<ref.*?</ref>%%g" | grep -v "Celsius" | grep "0s" | sort > tmp-temperature-convert6.txt
 
 # low 40s F (~5°C)
 # mid 40s F (~7°C)
@@ -134,7 +144,7 @@ grep '[0-9][0-9],' tmp-temp-weather.txt | grep -iP "weather=" | sort > tmp-tempe
 
 
 echo "  Beginning degree scan..."
-../venv/bin/python3 ../dump_grep_csv.py "degrees? \[*(C|c|F)" | perl -pe "s%<ref.*?</ref>%%g" | grep -P "degrees? \[*(C|c|F)" | sort > tmp-temperature-convert4.txt
+cat tmp-grep-temp-degrees.txt | perl -pe "s%<ref.*?</ref>%%g" | grep -P "degrees? \[*(C|c|F)" | sort > tmp-temperature-convert4.txt
 
 cat tmp-temperature-convert1.txt tmp-temperature-convert2.txt tmp-temperature-convert3.txt tmp-temperature-convert4.txt tmp-temperature-convert4b.txt tmp-temperature-convert4c.txt tmp-temperature-convert5.txt tmp-temperature-convert6.txt | perl -pe 's/^(.*?):.*/$1/' | uniq > jwb-temperature-convert.txt
 
@@ -150,10 +160,10 @@ echo `date`
 
 # Run time for this segment: About 1 h 40 min
 
-../venv/bin/python3 ../dump_grep_csv.py 'mph|MPH' | perl -pe "s/\{\{([Cc]onvert|[Cc]vt).*?\}\}//g" | perl -pe "s%<ref.*?</ref>%%g" | grep -vP 'km/h.{0,30}mph' | grep -vP 'mph.{0,30}km/h' | grep -iP "\bmph\b" | grep -v ", MPH" | grep -iP "(speed|mile|[0-9](&nbsp;| )MPH)" | grep -v "mph=" | sort > tmp-mph-convert.txt
+cat tmp-grep-mph.txt | perl -pe "s/\{\{([Cc]onvert|[Cc]vt).*?\}\}//g" | perl -pe "s%<ref.*?</ref>%%g" | grep -vP 'km/h.{0,30}mph' | grep -vP 'mph.{0,30}km/h' | grep -iP "\bmph\b" | grep -v ", MPH" | grep -iP "(speed|mile|[0-9](&nbsp;| )MPH)" | grep -v "mph=" | sort > tmp-mph-convert.txt
 cat tmp-mph-convert.txt | perl -pe 's/^(.*?):.*/$1/' | uniq > jwb-speed-convert.txt
 
-../venv/bin/python3 ../dump_grep_csv.py '[0-9](&nbsp;| )?kph|KPH' | sort > tmp-kph-convert.txt
+cat tmp-grep-kph.txt | sort > tmp-kph-convert.txt
 
 # --- MORE METRIC CONVERSIONS ---
 
@@ -174,7 +184,7 @@ echo `date`
 # {{cvt}} or {{convert}} should probably be used in all instances to
 # convert between US and imperial gallons (ug!)
 # ../venv/bin/python3 ../dump_grep_csv.py 'mpg|MPG' | perl -pe "s/\{\{([Cc]onvert|[Cc]vt).*?\}\}//g" | perl -pe "s%<ref.*?</ref>%%g" | grep -iP "\bmpg\b" | grep -iP "[0-9]( |&nbsp;)mpg" | grep -vP 'L/100.{0,30}mpg' | grep -vP 'mpg.{0,30}L/100'| sort > tmp-mpg-convert.txt
-../venv/bin/python3 ../dump_grep_csv.py 'mpg|MPG' | perl -pe "s/\{\{([Cc]onvert|[Cc]vt).*?\}\}//g" | perl -pe "s%<ref.*?</ref>%%g" | grep -iP "\bmpg\b" | grep -iP "[0-9]( |&nbsp;)mpg" | sort > tmp-mpg-convert.txt
+cat tmp-grep-mpg.txt | perl -pe "s/\{\{([Cc]onvert|[Cc]vt).*?\}\}//g" | perl -pe "s%<ref.*?</ref>%%g" | grep -iP "\bmpg\b" | grep -iP "[0-9]( |&nbsp;)mpg" | sort > tmp-mpg-convert.txt
 
 cat tmp-mpg-convert.txt | perl -pe 's/^(.*?):.*/$1/' | uniq > jwb-mpg-convert.txt
 
@@ -190,11 +200,11 @@ echo `date`
 # Run time for this segment: ~3 h 50 min
 
 # Incorrect template usage
-../venv/bin/python3 ../dump_grep_csv.py "\{\{prime\}\}" | perl -pe 's/^(.*?):.*/$1/' | uniq | sort > jwb-articles-prime.txt
-../venv/bin/python3 ../dump_grep_csv.py "\{\{prime\|'" | perl -pe 's/^(.*?):.*/$1/' | uniq | sort >> jwb-articles-prime.txt
+cat tmp-grep-prime.txt | perl -pe 's/^(.*?):.*/$1/' | uniq | sort > jwb-articles-prime.txt
+cat tmp-grep-prime-arg.txt | perl -pe 's/^(.*?):.*/$1/' | uniq | sort >> jwb-articles-prime.txt
 
 # Can be converted to {{coord}} or {{sky}} or {{prime}}
-../venv/bin/python3 ../dump_grep_csv.py "[0-9]+° ?[0-9]+['′] ?" | perl -pe 's/^(.*?):.*/$1/' | uniq | sort >> jwb-articles-prime.txt
+cat tmp-grep-prime-arc.txt | perl -pe 's/^(.*?):.*/$1/' | uniq | sort >> jwb-articles-prime.txt
 
 # --- FRAC REPAIR ---
 
@@ -203,7 +213,7 @@ echo `date`
 echo "Beginning {{frac}} repair scan"
 echo `date`
 
-../venv/bin/python3 ../dump_grep_csv.py '[0-9]\{\{frac\|[0-9]+\|' | perl -pe 's/^(.*?):.*/$1/' | uniq | sort > jwb-frac-repair.txt
+cat tmp-grep-frac.txt | perl -pe 's/^(.*?):.*/$1/' | uniq | sort > jwb-frac-repair.txt
 
 # --- BROKEN NBSP ---
 
@@ -212,7 +222,7 @@ echo `date`
 echo "Beginning broken nbsp scan"
 echo `date`
 
-../venv/bin/python3 ../dump_grep_csv.py "&nbsp[^;}]" | grep -vP 'https?:[^ ]+&nbsp' | perl -pe 's/^(.*?):.*/$1/' | uniq | sort | perl -pe 's/^(.*)$/* [[$1]]/' > beland-broken-nbsp.txt
+cat tmp-grep-nbsp.txt | grep -vP 'https?:[^ ]+&nbsp' | perl -pe 's/^(.*?):.*/$1/' | uniq | sort | perl -pe 's/^(.*)$/* [[$1]]/' > beland-broken-nbsp.txt
 
 # --- MOS:LOGICAL ---
 
@@ -220,7 +230,7 @@ echo `date`
 
 echo "Beginning MOS:LOGICAL scan"
 echo `date`
-../venv/bin/python3 ../dump_grep_csv.py '"[a-z ,:\-;]+[,\.]"' | perl -pe 's/^(.*?):.*/$1/' | uniq | sort | uniq > beland-MOS-LOGICAL.txt
+cat tmp-grep-mos-logical.txt | perl -pe 's/^(.*?):.*/$1/' | uniq | sort | uniq > beland-MOS-LOGICAL.txt
 
 # --- MOS:DOUBLE ---
 
@@ -228,7 +238,7 @@ echo `date`
 
 echo "Beginning MOS:DOUBLE scan"
 echo `date`
-../venv/bin/python3 ../dump_grep_csv.py " '[A-Za-z ,:\-;]+'[,\. \}\)]" | grep -v '"' | grep -vP "{{([Ll]ang|[Tt]ransl|IPA)" | perl -pe 's/^(.*?):.*/$1/' > tmp-MOS-double.txt
+cat tmp-grep-mos-double.txt | grep -v '"' | grep -vP "{{([Ll]ang|[Tt]ransl|IPA)" | perl -pe 's/^(.*?):.*/$1/' > tmp-MOS-double.txt
 cat tmp-MOS-double.txt | perl ../count.pl | sort -rn > tmp-double-most.txt
 grep -vP "(grammar|languag|species| words)" tmp-double-most.txt | perl -pe "s/^\d+\t//" | head -1000 > jwb-double-most.txt
 
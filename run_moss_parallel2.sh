@@ -16,7 +16,9 @@ echo `date`
 echo "Beginning main Wikipedia spell check"
 echo `date`
 
-../venv/bin/python3 ../moss_spell_check.py > tmp-output.txt
+# Output is split by record type into spell-channels/ (see
+# record_channels.py) so the steps below only read what they need
+MOSS_SPELL_CHANNELS=spell-channels ../venv/bin/python3 ../moss_spell_check.py
 
 # --- SPELL CHECK WORD CATEGORIZATION AND PARSE FAILURE POST-PROCESSING ---
 
@@ -24,22 +26,22 @@ echo "Beginning word categorization run 1"
 echo `date`
 
 # Run time for this segment: ~25 min (8-core parallel)
-grep ^@ tmp-output.txt | sort -nr -k2 > /tmp/sorted_by_article.txt
+sort -nr -k2 spell-channels/articles.txt > /tmp/sorted_by_article.txt
 # Sort takes ~37sec
 cat /tmp/sorted_by_article.txt | ../venv/bin/python3 ../by_article_processor.py > tmp-articles-linked-words.txt
 rm -rf /tmp/sorted_by_article.txt
 # TODO: Can this run as one line, or is that the source of the .py command not found error?
-# grep ^@ tmp-output.txt | sort -nr -k2 | ../venv/bin/python3 ../by_article_processor.py > tmp-articles-linked-words.txt
+# sort -nr -k2 spell-channels/articles.txt | ../venv/bin/python3 ../by_article_processor.py > tmp-articles-linked-words.txt
 
-grep -P '^!\t' tmp-output.txt | perl -pe 's/.*?\t//' | sort > err-parse-failures.txt
-grep -P '^\!Q' tmp-output.txt | perl -pe 's/^\!Q\t\* \[\[(.*?)\]\].*$/$1/' | sort | ../venv/bin/python3 ../sectionalizer.py LARGE > jwb-straight-quotes-unbalanced.txt
-grep ^G tmp-output.txt | ../venv/bin/python3 ../rollup_ignored.py | sort -nr -k2 > debug-spellcheck-ignored.txt
+perl -pe 's/.*?\t//' spell-channels/parse-failures.txt | sort > err-parse-failures.txt
+perl -pe 's/^\!Q\t\* \[\[(.*?)\]\].*$/$1/' spell-channels/straight-quotes.txt | sort | ../venv/bin/python3 ../sectionalizer.py LARGE > jwb-straight-quotes-unbalanced.txt
+../venv/bin/python3 ../rollup_ignored.py < spell-channels/ignored.txt | sort -nr -k2 > debug-spellcheck-ignored.txt
 
 echo "Beginning word categorization run 2"
 echo `date`
 
 # Run time for this line: ~20 min (8-core parallel)
-tac tmp-output.txt | grep '^*' | ../venv/bin/python3 ../word_categorizer.py > tmp-words-with-articles.txt
+tac spell-channels/typos.txt | ../venv/bin/python3 ../word_categorizer.py > tmp-words-with-articles.txt
 
 # --- BY ARTICLE ---
 
@@ -136,18 +138,19 @@ echo `date`
 
 # Feet and inches - [[MOS:UNITNAMES]]
 
+# Full-dump regex searches for this section, in one pass; see
+# dump_grep_manifest2.tsv
+../venv/bin/python3 ../dump_grep_multi.py ../dump_grep_manifest2.tsv
+
 grep -P "[0-9\.]+(&nbsp;| )?'[0-9\.]+(&nbsp;| ) ?\"[^0-9\.]" err-parse-failures.txt | grep -v ° > tmp-feet-inches1.txt
 grep -P '[0-9\.]+"(&nbsp;| )?(x|by|×)(&nbsp;| )?[0-9\./]+"' err-parse-failures.txt > tmp-feet-inches2.txt
 grep -P '[0-9\.]+"' err-parse-failures.txt > tmp-feet-inches3.txt
 cat tmp-feet-inches2.txt tmp-feet-inches1.txt tmp-feet-inches3.txt | perl -pe 's/^\* \[\[(.*?)\]\] - .*$/$1/' | uniq > jwb-feet-inches-err.txt
-../venv/bin/python3 ../dump_grep_csv.py "[0-9\.]+(&nbsp;| )?'[0-9\.]+(&nbsp;| ) ?\"[^0-9\.]" > tmp-feet-inches-all1.txt
-../venv/bin/python3 ../dump_grep_csv.py '[0-9\.]+"(&nbsp;| )?(x|by|×)(&nbsp;| )?[0-9\./]+"' > tmp-feet-inches-all2.txt
-../venv/bin/python3 ../dump_grep_csv.py ' [^"][0-9]"' tmp-feet-inches-all3.txt | perl -pe 's/<.*?>//g' | perl -pe 's/[\( \|]"[a-zA-Z][^"]*[0-9]"//g' | perl -pe 's/"[0-9\.]+"//g' | grep -P '[0-9]"' > tmp-feet-inches-all3.txt
+cat tmp-grep-feet-inches3.txt | perl -pe 's/<.*?>//g' | perl -pe 's/[\( \|]"[a-zA-Z][^"]*[0-9]"//g' | perl -pe 's/"[0-9\.]+"//g' | grep -P '[0-9]"' > tmp-feet-inches-all3.txt
 cat tmp-feet-inches-all2.txt tmp-feet-inches-all1.txt tmp-feet-inches-all3.txt | perl -pe 's/^(.*?):.*/$1/' | uniq > jwb-feet-inches-all.txt
 
 # Units of arc - [[MOS:UNITNAMES]]
 grep -P "[0-9]+° ?[0-9]+' ?[0-9]+\"" err-parse-failures.txt | perl -pe 's/^\* \[\[(.*?)\]\] - .*$/$1/' | sort | uniq > jwb-arc-units.txt
-../venv/bin/python3 ../dump_grep_csv.py "[0-9]+° ?[0-9]+' ?[0-9]+\"" > tmp-arc-units-all.txt
 cat tmp-arc-units-all.txt | perl -pe 's/^(.*?):.*/$1/' | sort | uniq >> jwb-arc-units.txt
 
 # See also: jwb-straight-quotes-unbalanced.txt
@@ -201,7 +204,7 @@ cat tmp-words-with-articles.txt | ../venv/bin/python3 ../count_by_rating.py >> p
 echo "Beginning dash report"
 echo `date`
 
-grep ^D tmp-output.txt | perl -pe 's/^D\t'// | sort -k3 | ../venv/bin/python3 ../sectionalizer.py > debug-dashes.txt
+perl -pe 's/^D\t'// spell-channels/dashes.txt | sort -k3 | ../venv/bin/python3 ../sectionalizer.py > debug-dashes.txt
 # TODO: Are spaced emdashes more common than unspaced?  I like them
 # better but they go against the style guide. -- Beland
 #
@@ -3,10 +3,10 @@ set -e
 echo "Running Wiktionary spell check"
 echo `date`
 
-../venv/bin/python3 ../moss_spell_check_wiktionary.py > tmp-wiktionary-spell.txt
+MOSS_SPELL_CHANNELS=wiktionary-spell-channels ../venv/bin/python3 ../moss_spell_check_wiktionary.py
 # Run time: About 30 min
 
-../venv/bin/python3 ../moss_spell_check_wiktionary_with_quotations.py > tmp-wiktionary-spell-with-quotations.txt
+MOSS_SPELL_CHANNELS=wiktionary-spell-with-quotations-channels ../venv/bin/python3 ../moss_spell_check_wiktionary_with_quotations.py
 # Run time: About 30 min
 
 # --- WITHOUT QUOTATIONS ---
@@ -16,7 +16,7 @@ echo `date`
 
 # Few if any English misspellings: H, BW, TF, T/, A, BC, P, L
 
-tac tmp-wiktionary-spell.txt | grep '^*' | ../venv/bin/python3 ../word_categorizer.py > tmp-words-with-articles-wikt.txt
+tac wiktionary-spell-channels/typos.txt | ../venv/bin/python3 ../word_categorizer.py > tmp-words-with-articles-wikt.txt
 
 echo "==Possible typos from (DUMP NAME) ==" > post-wikt-typos.txt
 
@@ -52,7 +52,7 @@ grep ^TS tmp-words-with-articles-wikt.txt | perl -pe "s/^TS\t//" >> post-wikt-ty
 # --- WITH QUOTATIONS ---
 
 # Run time: About 10 min
-tac tmp-wiktionary-spell-with-quotations.txt | grep '^*' | ../venv/bin/python3 ../word_categorizer.py > tmp-words-with-articles-wikt-with-quotations.txt
+tac wiktionary-spell-with-quotations-channels/typos.txt | ../venv/bin/python3 ../word_categorizer.py > tmp-words-with-articles-wikt-with-quotations.txt
 
 grep -P "^(HB|HL)" tmp-words-with-articles-wikt-with-quotations.txt | perl -pe "s/^HB\t//" | perl -pe 's/</&lt;/g' | perl -pe 's/>/&gt;/g' | grep -v "Unsupported titles/HTML" > post-wikt-html.txt
 
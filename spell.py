@@ -1,18 +1,45 @@
 # -*- coding: utf-8 -*-
 
+from multiprocessing.util import Finalize
 import os
 import re
 from string import punctuation
 import sys
+import time
 from lru import LRU
 try:
     from wikitext_util import html_tag_re, contractions
     from unencode_entities import entities_re
+    from result_cache import get_files_version
+    from verdict_cache import add_verdicts, collect_stats, lookup_verdict, open_store, read_verdicts, save_stats
+    from word_table import is_table_current, open_word_table, word_table_contains, write_word_table
 except ImportError:
     from .wikitext_util import html_tag_re
     from .unencode_entities import entities_re
+    from .result_cache import get_files_version
+    from .verdict_cache import add_verdicts, collect_stats, lookup_verdict, open_store, read_verdicts, save_stats
+    from .word_table import is_table_current, open_word_table, word_table_contains, write_word_table
+
+# Downloaded word lists, combined into all_words by load_data()
+MOSS_HTML_FILE = "/var/local/moss/bulk-wikipedia/For_Wiktionary"
+TITLE_FILES = [
+    "/var/local/moss/bulk-wikipedia/enwiktionary-latest-all-titles-in-ns0",
+    "/var/local/moss/bulk-wikipedia/enwiki-latest-all-titles-in-ns0",
+    "/var/local/moss/bulk-wikipedia/specieswiki-latest-all-titles-in-ns0",
+    "/var/local/moss/bulk-wikipedia/Wikispecies:Requested_articles",
+    "/var/local/moss/bulk-wikipedia/Before_2019",
+    "/var/local/moss/bulk-wikipedia/2020",
+    "/var/local/moss/bulk-wikipedia/2021",
+    "/var/local/moss/bulk-wikipedia/Old_case_notes",
+]
+DICTIONARY_SOURCE_FILES = [MOSS_HTML_FILE] + TITLE_FILES
+
+# Precompiled all_words (see word_table.py), written by running
+# "spell.py --build-dictionary" after downloading the word lists
+DICTIONARY_TABLE_FILE = "/var/local/moss/bulk-wikipedia/spell-dictionary.bin"
 
 all_words = set()
+dictionary_table = None
 punctuation_tmp = punctuation
 punctuation_re = re.compile(r"[ " + punctuation + r"]")
 compound_separators_re = re.compile(r"[—–/\-]")
@@ -41,12 +68,10 @@ def add_tokens(line):
 def load_data():
     print("Loading spellcheck dictionary...", file=sys.stderr)
 
-    # TODO: Possibly move this to postgres or MySQL.  Load DB as part
-    # of update_downloads.sh; startup time is very slow due to loading
-    # this all into Python, even though accessing in-memory data is
-    # very fast.
+    # Startup time is very slow due to loading this all into Python,
+    # so normally this only runs when building DICTIONARY_TABLE_FILE.
 
-    with open("/var/local/moss/bulk-wikipedia/For_Wiktionary", "r") as moss_html_file:
+    with open(MOSS_HTML_FILE, "r") as moss_html_file:
         moss_html = moss_html_file.read()
         queued_matches = re.findall('"https://en.wiktionary.org/wiki/(.*?)"', moss_html)
         if not queued_matches:
@@ -54,23 +79,37 @@ def load_data():
         for queued_match in queued_matches:
             add_tokens(queued_match)
 
-    for filename in [
-            "/var/local/moss/bulk-wikipedia/enwiktionary-latest-all-titles-in-ns0",
-            "/var/local/moss/bulk-wikipedia/enwiki-latest-all-titles-in-ns0",
-            "/var/local/moss/bulk-wikipedia/specieswiki-latest-all-titles-in-ns0",
-            "/var/local/moss/bulk-wikipedia/Wikispecies:Requested_articles",
-            "/var/local/moss/bulk-wikipedia/Before_2019",
-            "/var/local/moss/bulk-wikipedia/2020",
-            "/var/local/moss/bulk-wikipedia/2021",
-            "/var/local/moss/bulk-wikipedia/Old_case_notes",
-    ]:
+    for filename in TITLE_FILES:
         with open(filename, "r") as title_list:
             for line in title_list:
                 add_tokens(line)
 
 
-if not os.environ.get("NO_LOAD"):
+def load_dictionary():
+    global dictionary_table
+    if is_table_current(DICTIONARY_TABLE_FILE, DICTIONARY_SOURCE_FILES):
+        dictionary_table = open_word_table(DICTIONARY_TABLE_FILE)
+    else:
+        print(f"{DICTIONARY_TABLE_FILE} missing or out of date; run spell.py --build-dictionary", file=sys.stderr)
+        load_data()
+
+
+def build_dictionary_table():
     load_data()
+    count = write_word_table(DICTIONARY_TABLE_FILE, all_words)
+    print(f"Wrote {count} words to {DICTIONARY_TABLE_FILE}", file=sys.stderr)
+
+
+def is_in_dictionary(word_lower):
+    if dictionary_table:
+        return word_table_contains(dictionary_table, word_lower)
+    return word_lower in all_words
+
+
+if __name__ == '__main__' and sys.argv[1:] == ["--build-dictionary"]:
+    build_dictionary_table()
+elif not os.environ.get("NO_LOAD"):
+    load_dictionary()
 
 
 abbr_re = re.compile(r"\.\w\.$")
@@ -505,6 +544,22 @@ bad_characters = {
     # "º",
 }
 
+# One compiled scan for all of bad_characters: a character class for
+# the single characters, plus an alternation for any longer
+# substrings.  Nearly all entries are non-ASCII, so ASCII-only words
+# (most words) only need checking for the few ASCII entries.
+bad_substrings_ascii = [substring for substring in bad_characters if substring.isascii()]
+bad_characters_re = re.compile("|".join(
+    [re.escape(substring) for substring in sorted(bad_characters, key=len, reverse=True) if len(substring) > 1]
+    + ["[%s]" % "".join(re.escape(char) for char in sorted(bad_characters) if len(char) == 1)]))
+
+
+def has_bad_characters(word):
+    if word.isascii():
+        return any(substring in word for substring in bad_substrings_ascii)
+    return bool(bad_characters_re.search(word))
+
+
 # Treated as separate words by NLTK tokenizer
 allow_list = {
 
@@ -557,7 +612,134 @@ allow_list = {
 print("Done.", file=sys.stderr)
 
 
-cached_answers = LRU(10000)
+# --- Verdict cache ---
+
+# For speed.  Should work well because in most articles the same words
+# are used several times, and English has a small number of highly
+# used words across all articles.
+#
+# The spellcheck reports also call enable_verdict_cache() to save
+# verdicts to VERDICT_CACHE_FILE (see verdict_cache.py), which warms
+# the cache for the next run (and for the other spellcheck reports).
+# Other importers of this module only use the in-memory cache.
+# Environment variables:
+#   MOSS_SPELL_CACHE_SIZE: number of verdicts kept in memory per process
+#   MOSS_SPELL_CACHE_FILE: where verdicts are saved; empty to disable
+#     (always disabled with NO_LOAD, since there's no dictionary)
+#   MOSS_SPELL_CACHE_SHARED: if set, look up verdicts saved by other
+#     processes (such as other pool workers) before computing them
+VERDICT_CACHE_SIZE = int(os.environ.get("MOSS_SPELL_CACHE_SIZE") or 200000)
+VERDICT_CACHE_FILE = "" if os.environ.get("NO_LOAD") else os.environ.get("MOSS_SPELL_CACHE_FILE", "/var/local/moss/bulk-wikipedia/spell-verdicts.sqlite")
+VERDICT_CACHE_SHARED = bool(os.environ.get("MOSS_SPELL_CACHE_SHARED"))
+# New verdicts are saved in batches of this many words
+VERDICT_SAVE_BATCH_SIZE = 20000
+
+# Verdicts depend on this code and the dictionary (and
+# DICTIONARY_TABLE_FILE, if it has been built)
+VERDICT_DEPENDENCIES = [
+    __file__,
+    os.path.join(os.path.dirname(__file__), "wikitext_util.py"),
+    os.path.join(os.path.dirname(__file__), "unencode_entities.py"),
+    os.path.join(os.path.dirname(__file__), "word_table.py"),
+] + DICTIONARY_SOURCE_FILES
+
+verdict_cache_stats = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0}
+# Verdicts used since they were last saved: word -> (answer, number of uses)
+unsaved_verdicts = {}
+# Identifies the processes of one run (forked workers inherit this)
+verdict_run_pid = os.getpid()
+verdict_run_id = f"{verdict_run_pid}-{time.time_ns()}"
+verdict_cache_enabled = False
+verdict_store = None
+verdict_store_pid = None
+
+
+def count_eviction(word_mixedcase, answer):
+    verdict_cache_stats["evictions"] += 1
+
+
+cached_answers = LRU(VERDICT_CACHE_SIZE, callback=count_eviction)
+
+
+def get_verdict_store():
+    # One connection per process, since pool workers are forked from
+    # the process that loaded this module
+    global verdict_store
+    global verdict_store_pid
+    if verdict_store_pid != os.getpid():
+        dependencies = VERDICT_DEPENDENCIES
+        if os.path.exists(DICTIONARY_TABLE_FILE):
+            dependencies = dependencies + [DICTIONARY_TABLE_FILE]
+        verdict_store = open_store(VERDICT_CACHE_FILE, get_files_version(dependencies))
+        verdict_store_pid = os.getpid()
+        # Runs when the process (or pool worker) exits normally
+        Finalize(None, save_verdicts, exitpriority=10)
+    return verdict_store
+
+
+def warm_verdict_cache():
+    # Least used first, so the most used are least likely to be evicted
+    verdicts = read_verdicts(get_verdict_store(), VERDICT_CACHE_SIZE)
+    for (word_mixedcase, answer) in reversed(verdicts):
+        cached_answers[word_mixedcase] = answer
+    print(f"Loaded {len(verdicts)} cached spellcheck verdicts", file=sys.stderr)
+
+
+def enable_verdict_cache():
+    # Saves verdicts to VERDICT_CACHE_FILE from now on, after loading
+    # the ones saved by previous runs.  Call before starting the pool.
+    global verdict_cache_enabled
+    if not VERDICT_CACHE_FILE or verdict_cache_enabled:
+        return
+    verdict_cache_enabled = True
+    warm_verdict_cache()
+
+
+def save_verdicts():
+    if not verdict_cache_enabled:
+        return
+    store = get_verdict_store()
+    add_verdicts(store, unsaved_verdicts)
+    unsaved_verdicts.clear()
+    if os.getpid() != verdict_run_pid:
+        # Pool workers; see report_verdict_cache_stats()
+        save_stats(store, verdict_run_id, os.getpid(), verdict_cache_stats)
+
+
+def report_verdict_cache_stats():
+    # Totals for this process and all its pool workers
+    stats = dict(verdict_cache_stats)
+    if verdict_cache_enabled:
+        save_verdicts()
+        for (name, value) in collect_stats(get_verdict_store(), verdict_run_id).items():
+            stats[name] += value
+    lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+    hit_percent = round(100 * (lookups - stats["misses"]) / max(lookups, 1), 2)
+    print(f"Spellcheck verdict cache (size {VERDICT_CACHE_SIZE} per process): {stats['hits']} hits, "
+          f"{stats['shared_hits']} shared hits, {stats['misses']} misses ({hit_percent}% hit rate), "
+          f"{stats['evictions']} evictions", file=sys.stderr)
+
+
+def get_answer(word_mixedcase):
+    answer = cached_answers.get(word_mixedcase)
+    if answer is not None:
+        verdict_cache_stats["hits"] += 1
+    else:
+        if VERDICT_CACHE_SHARED and verdict_cache_enabled:
+            answer = lookup_verdict(get_verdict_store(), word_mixedcase)
+        if answer is not None:
+            verdict_cache_stats["shared_hits"] += 1
+        else:
+            verdict_cache_stats["misses"] += 1
+            answer = _is_word_spelled_correctly_impl(word_mixedcase)
+        cached_answers[word_mixedcase] = answer
+
+    if verdict_cache_enabled:
+        (_, uses) = unsaved_verdicts.get(word_mixedcase, (None, 0))
+        unsaved_verdicts[word_mixedcase] = (answer, uses + 1)
+        if len(unsaved_verdicts) >= VERDICT_SAVE_BATCH_SIZE:
+            save_verdicts()
+    return answer
 
 
 # Returns True, False, or "uncertain"
@@ -566,14 +748,26 @@ def is_word_spelled_correctly(word_mixedcase):
     if not word_mixedcase:
         return True
 
-    # For speed.  Should work well because in most articles the same
-    # words are used several times, and English has a small number of
-    # highly used words across all articles.
-    if word_mixedcase in cached_answers:
-        return cached_answers[word_mixedcase]
-    answer = _is_word_spelled_correctly_impl(word_mixedcase)
-    cached_answers[word_mixedcase] = answer
-    return answer
+    return get_answer(word_mixedcase)
+
+
+# Returns the answers is_word_spelled_correctly() would give for each
+# of words, checking each distinct word only once.  For callers
+# that have a whole article's worth of words at once.
+def classify_words(words):
+    words = list(words)
+    distinct_words = set(words)
+    answers = {}
+
+    # Bulk set operations first; the rest of the cascade only runs on
+    # words not resolved here.
+    answers[""] = True
+    for word_mixedcase in distinct_words & bad_words:
+        answers[word_mixedcase] = False
+    for word_mixedcase in distinct_words - answers.keys():
+        answers[word_mixedcase] = get_answer(word_mixedcase)
+
+    return [answers[word_mixedcase] for word_mixedcase in words]
 
 
 def _is_word_spelled_correctly_impl(word_mixedcase):
@@ -587,10 +781,10 @@ def _is_word_spelled_correctly_impl(word_mixedcase):
         # and/or multi-word proper nouns.
         return False
 
-    if any(substring in word_mixedcase for substring in bad_characters):
+    if has_bad_characters(word_mixedcase):
         return False
 
-    if word_mixedcase.lower() in all_words:
+    if is_in_dictionary(word_mixedcase.lower()):
         return True
 
     if word_mixedcase in allow_list:
@@ -640,7 +834,7 @@ def _is_word_spelled_correctly_impl(word_mixedcase):
     if search_again:
         if not word_mixedcase:
             return True
-        if word_mixedcase.lower() in all_words:
+        if is_in_dictionary(word_mixedcase.lower()):
             return True
 
     word_parts_mixedcase = compound_separators_re.split(word_mixedcase)
@@ -668,7 +862,7 @@ def _is_word_spelled_correctly_impl(word_mixedcase):
     if not all_letters_re.match(word_mixedcase):
         if period_splice_re.match(word_mixedcase):
             plus_period = "%s." % word_mixedcase.lower()
-            if plus_period in all_words:
+            if is_in_dictionary(plus_period):
                 # Because the word segmenter often doesn't keep the
                 # trailing period with the word.  TODO: Catch situations
                 # where the trailing period is actually missing.
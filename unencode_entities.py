@@ -1,3 +1,4 @@
+from collections import defaultdict
 import fileinput
 import re
 import sys
@@ -1736,8 +1737,11 @@ greek_letters = {
 }
 
 
+char_num_re = re.compile("&#(x?[0-9a-fA-F]+);")
+
+
 def find_char_num(entity):
-    result = re.match("&#(x?[0-9a-fA-F]+);", entity)
+    result = char_num_re.match(entity)
     if result:
         number = result.group(1)
         if number.startswith("x"):
@@ -1857,18 +1861,129 @@ def make_character_or_ignore(entity):
     return character
 
 
-def fix_text(text, transform_greek=False):
+# --- Compiled replacement ---
+
+# fix_text() used to call text.replace() once for every entry in the
+# conversion table, in order.  Instead, the table is compiled (once
+# per mode) into a few "stages", each of which replaces all of its
+# strings in one left-to-right scan.  A string is put in a new stage
+# if doing it in the same scan as an earlier string could give a
+# different result from the chain of text.replace() calls:
+#
+# * The two strings overlap (one contains the other, or the end of one
+#   is the start of the other), so which one is replaced depends on
+#   the order.
+# * The earlier string's replacement can form the later string, which
+#   the chain would then also replace (e.g. "&#x200C;" -> "&zwnj;" ->
+#   "").
+# * The earlier string is deleted, which can join the text on either
+#   side into the later string.
+#
+# Run with --conflicts to list the pairs of strings whose order
+# matters.
+
+
+def end_overlaps_start(string1, string2):
+    # True if a proper suffix of string1 is a prefix of string2
+    index = string1.find(string2[0], 1)
+    while index > -1:
+        if string2.startswith(string1[index:]):
+            return True
+        index = string1.find(string2[0], index + 1)
+    return False
+
+
+def strings_can_overlap(string1, string2):
+    # True if string1 and string2 can overlap in a text, including one
+    # containing the other
+    if string1 in string2 or string2 in string1:
+        return True
+    return end_overlaps_start(string1, string2) or end_overlaps_start(string2, string1)
+
+
+def get_replacement_conflict(from_string, to_string, later_string):
+    # Returns why replacing from_string with to_string before
+    # later_string differs from replacing both in one scan, or None
+    if strings_can_overlap(from_string, later_string):
+        return "overlap"
+    if not to_string and len(later_string) > 1:
+        return "deletion"
+    if to_string and strings_can_overlap(to_string, later_string):
+        return "creates"
+    return None
+
+
+def make_replacement_stage(replacements):
+    # Longest first, for longest-match
+    strings_re = re.compile("|".join(re.escape(from_string) for from_string in sorted(replacements, key=len, reverse=True)))
+    return (strings_re, replacements)
+
+
+def compile_replacements(conversion_dict):
+    # Returns a list of stages (see apply_replacements()) with the same
+    # result as calling text.replace() for each item in order
+    stages = []
+    stage_replacements = {}
+    for (from_string, to_string) in conversion_dict.items():
+        if not from_string:
+            continue
+        if any(get_replacement_conflict(earlier_string, earlier_replacement, from_string)
+               for (earlier_string, earlier_replacement) in stage_replacements.items()):
+            stages.append(make_replacement_stage(stage_replacements))
+            stage_replacements = {}
+        stage_replacements[from_string] = to_string
+    if stage_replacements:
+        stages.append(make_replacement_stage(stage_replacements))
+    return stages
+
+
+def find_replacement_conflicts(conversion_dict):
+    # Returns (earlier string, later string, reason) for every pair of
+    # items whose order matters
+    items = [item for item in conversion_dict.items() if item[0]]
+    return [(earlier_string, later_string, reason)
+            for (index, (earlier_string, earlier_replacement)) in enumerate(items)
+            for (later_string, _) in items[index + 1:]
+            for reason in [get_replacement_conflict(earlier_string, earlier_replacement, later_string)]
+            if reason]
+
 
+def apply_replacements(text, stages):
+    for (strings_re, replacements) in stages:
+        text = strings_re.sub(lambda match: replacements[match.group()], text)
+    return text
+
+
+# Compiled conversion tables, by value of transform_greek
+compiled_conversions = {}
+
+
+def get_conversion_dict(transform_greek):
     if transform_greek:
         conversion_dict = transform.copy()
         conversion_dict.update(greek_letters)
         conversion_dict.update(controversial)
-    else:
-        conversion_dict = transform
+        return conversion_dict
+    return transform
 
-    new_text = text
-    for (from_string, to_string) in conversion_dict.items():
-        new_text = new_text.replace(from_string, to_string)
+
+def get_compiled_conversion(transform_greek):
+    # Compiled on first use, after transform has been updated for
+    # --safe (below)
+    if transform_greek not in compiled_conversions:
+        compiled_conversions[transform_greek] = compile_replacements(get_conversion_dict(transform_greek))
+    return compiled_conversions[transform_greek]
+
+
+def fix_text(text, transform_greek=False):
+
+    new_text = apply_replacements(text, get_compiled_conversion(transform_greek))
+
+    # Only numeric entities are converted below, and only ones that
+    # are already in new_text can be changed, so skip building
+    # test_string if none of them would be
+    if not any(make_character_or_ignore(entity) is not None for entity in entities_re.findall(new_text)):
+        return new_text
 
     test_string = new_text
     for string in keep:
@@ -1884,12 +1999,31 @@ def fix_text(text, transform_greek=False):
     return new_text
 
 
+def report_conflicts():
+    # Lists the pairs of strings in the conversion tables that are
+    # replaced in a different stage because their order matters.
+    # Deletions conflict with nearly every later string, so they are
+    # only counted.
+    for transform_greek in [False, True]:
+        print(f"=== transform_greek={transform_greek}: {len(get_compiled_conversion(transform_greek))} stages ===")
+        deletions = defaultdict(int)
+        for (earlier_string, later_string, reason) in find_replacement_conflicts(get_conversion_dict(transform_greek)):
+            if reason == "deletion":
+                deletions[earlier_string] += 1
+            else:
+                print(f"{reason}\t{earlier_string}\t{later_string}")
+        for (earlier_string, count) in deletions.items():
+            print(f"deletion\t{earlier_string}\t({count} later strings)")
+
+
 if len(sys.argv) > 1 and "--safe" in sys.argv:
     pass
 else:
     transform.update(transform_unsafe)
 
-if __name__ == '__main__':
+if __name__ == '__main__' and "--conflicts" in sys.argv:
+    report_conflicts()
+elif __name__ == '__main__':
     for line in fileinput.input("-"):
         new_line = fix_text(line)
         sys.stdout.write(new_line)
@@ -1,14 +1,127 @@
 from collections import defaultdict
+import os
 from pprint import pformat
+import re
+import tempfile
 import unittest
 
 # Enabling this makes init fast but breaks spelling tests
 # import os
 # os.environ["NO_LOAD"] = "1"
-from .spell import is_word_spelled_correctly  # noqa: E402
+from .spell import classify_words, is_word_spelled_correctly  # noqa: E402
 
-from .wikitext_util import remove_structure_nested, wikitext_to_plaintext  # noqa: E402
-from .word_categorizer import (letters_introduced_alphabetically, make_suggestion_dict, make_edits_lowfi)  # noqa: E402
+from .article_store import load_index, open_article_store, page_generator_store, read_record, write_article_store  # noqa: E402
+from .needle_counter import count_needles, make_needle_counter, may_contain_needles, tally_chars  # noqa: E402
+
+from .unencode_entities import apply_replacements, compile_replacements, fix_text  # noqa: E402
+from .verdict_cache import add_verdicts, collect_stats, lookup_verdict, open_store, read_verdicts, save_stats  # noqa: E402
+from .wikitext_util import (apply_substitutions, compile_substitutions, early_substitutions, get_triggers, remove_structure_nested,  # noqa: E402
+                            substitutions, substitutions_sub_sup, wikitext_to_plaintext)
+from .word_table import (open_word_multimap, open_word_table, word_multimap_get, word_table_contains, word_table_words,  # noqa: E402
+                         write_word_multimap, write_word_table)
+from .word_categorizer import (bounded_edit_distance, get_symspell_suggestions, letters_introduced_alphabetically,  # noqa: E402
+                               make_suggestion_dict, make_edits_lowfi, make_symspell_dict)
+
+
+class ArticleStoreTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        pages = [("Alpha", "aaa\nbbb"), ("Łoś–Vaught test", ""), ("Gamma", "x\ry\tz")]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "articles.bin")
+            self.assertEqual(write_article_store(filename, pages), 3)
+            # Text is read back with the "\r" separator, as from the CSV
+            expected_pages = [(article_title, article_text + "\r") for (article_title, article_text) in pages]
+            self.assertEqual(list(page_generator_store(filename)), expected_pages)
+
+            index = load_index(filename)
+            store = open_article_store(filename)
+            (article_title, article_text, _) = read_record(store, index["Gamma"])
+            self.assertEqual((article_title, article_text), expected_pages[2])
+
+
+class WordTableTest(unittest.TestCase):
+
+    def test_contains(self):
+        words = {"cat", "dog", "łoś", "o'clock", "e.g.", ""}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "words.bin")
+            self.assertEqual(write_word_table(filename, words), len(words))
+            table = open_word_table(filename)
+            for word in words:
+                self.assertTrue(word_table_contains(table, word))
+            for word in ["ca", "cats", "Cat", "los", "dog "]:
+                self.assertFalse(word_table_contains(table, word))
+            self.assertEqual(set(word_table_words(table)), words)
+
+    def test_multimap(self):
+        mapping = {"1\tabc": ["cab", "abc"], "1\t*ab": ["bad"], "2\tł": []}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "suggestions.bin")
+            self.assertEqual(write_word_multimap(filename, mapping), len(mapping))
+            table = open_word_multimap(filename)
+            for (key, words) in mapping.items():
+                self.assertEqual(word_multimap_get(table, key), words)
+            self.assertIsNone(word_multimap_get(table, "1\tab"))
+
+
+class NeedleCounterTest(unittest.TestCase):
+
+    def test_count(self):
+        needles = ["½", "° C", "`", "F°", "ˢᵗ", "ᵗʰ", "°"]
+        counter = make_needle_counter(needles)
+        for text in ["", "plain text", "1½ ° C °C F° 2ˢᵗ 4ᵗʰ `x` ½", "ᵗʰᵗʰᵗ"]:
+            self.assertEqual(count_needles(counter, text),
+                             [(needle, text.count(needle)) for needle in needles if needle in text])
+
+    def test_tally(self):
+        self.assertEqual(tally_chars("a&b&c ½ é½"), {"&": 2, "½": 2, "é": 1})
+        counter = make_needle_counter(["½", "&frac12;"])
+        self.assertTrue(may_contain_needles(counter, tally_chars("½")))
+        self.assertTrue(may_contain_needles(counter, tally_chars("&")))
+        self.assertFalse(may_contain_needles(counter, tally_chars("é <b>")))
+
+
+class UnencodeEntitiesTest(unittest.TestCase):
+
+    def test_replacements(self):
+        # Order matters: "a" -> "b" feeds "bc", "xy" is deleted, and
+        # "ab" overlaps "a"
+        conversion_dict = {"a": "b", "bc": "C", "ab": "!", "xy": "", "q&": "&"}
+        stages = compile_replacements(conversion_dict)
+        self.assertGreater(len(stages), 1)
+        for text in ["", "abc", "ac xxyy q&amp; ab", "bcbc"]:
+            expected = text
+            for (from_string, to_string) in conversion_dict.items():
+                expected = expected.replace(from_string, to_string)
+            self.assertEqual(apply_replacements(text, stages), expected)
+
+    def test_fix_text(self):
+        self.assertEqual(fix_text("a&nbsp;b&ndash;c &#x2013; &#91;"), "a&nbsp;b&ndash;c – [")
+        self.assertEqual(fix_text("&alpha;"), "&alpha;")
+        self.assertEqual(fix_text("&alpha;", transform_greek=True), "α")
+
+
+class VerdictCacheTest(unittest.TestCase):
+
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "verdicts.sqlite")
+            store = open_store(filename, "v1")
+            add_verdicts(store, {"cat": (True, 3), "teh": (False, 1), "Ḩasan": ("uncertain", 2)})
+            add_verdicts(store, {"teh": (False, 5)})
+            self.assertEqual(read_verdicts(store, 2), [("teh", False), ("cat", True)])
+            self.assertEqual(lookup_verdict(store, "Ḩasan"), "uncertain")
+            self.assertIsNone(lookup_verdict(store, "dog"))
+
+            save_stats(store, "run", 1, {"hits": 5, "shared_hits": 0, "misses": 2, "evictions": 0})
+            save_stats(store, "run", 2, {"hits": 1, "shared_hits": 1, "misses": 1, "evictions": 3})
+            self.assertEqual(collect_stats(store, "run"), {"hits": 6, "shared_hits": 1, "misses": 3, "evictions": 3})
+            self.assertEqual(collect_stats(store, "run")["hits"], 0)
+            store.close()
+
+            # Verdicts from a different version are discarded
+            self.assertIsNone(lookup_verdict(open_store(filename, "v2"), "cat"))
 
 
 class WikitextUtilTest(unittest.TestCase):
@@ -50,6 +163,17 @@ iii"""
             remove_structure_nested("{{xxx yyy}} zzz", "{{", "}}"),
             "✂ zzz")
 
+        # Unbalanced
+        self.assertEqual(
+            remove_structure_nested("bbb {{ccc}} ddd}} eee", "{{", "}}"),
+            "bbb ✂ ddd}} eee")
+        self.assertEqual(
+            remove_structure_nested("aaa {{bbb {{ccc}} ddd", "{{", "}}"),
+            "aaa ✂✂ ddd")
+        self.assertEqual(
+            remove_structure_nested("aaa {{bbb {{ccc", "{{", "}}"),
+            "aaa ")
+
     def test_links(self):
         self.assertEqual(
             wikitext_to_plaintext("[[Regular page]]s"),
@@ -73,8 +197,51 @@ iii"""
             wikitext_to_plaintext(text_in),
             "a satisfiable theory is ✂-categorical (there exists an infinite cardinal ✂ such that)")
 
+    def test_substitutions(self):
+        # Combined and skipped steps must give the same result as
+        # running each substitution in order
+        text = "A&nbsp;b &NBSP; c<br />d<BR>e&amp;nbsp; {{x}}&ndash;y\n\n\nz<sup>2</sup> ''i'' '''b''' &mdash;"
+        for substitutions_list in [early_substitutions, substitutions, substitutions_sub_sup]:
+            expected = text
+            for (regex, replacement) in substitutions_list:
+                expected = regex.sub(replacement, expected)
+            self.assertEqual(
+                apply_substitutions(text, compile_substitutions(substitutions_list)),
+                expected)
+
+    def test_triggers(self):
+        # Same shape as the template pattern in
+        # moss_entity_check.suppression_patterns
+        regex = re.compile(r"{{([Nn]ot a typo|IPA|[Ll]ang\||[Ii]nterlinear ?\| ?lang=|([Ii]nfobox )?[Cc]hinese|[Cc]ode\s*\|).*?}}", flags=re.S)
+        self.assertEqual(
+            get_triggers(regex),
+            ("{{Chinese", "{{Code", "{{IPA", "{{Infobox Chinese", "{{Infobox chinese",
+             "{{Interlinear | lang=", "{{Interlinear |lang=", "{{Interlinear| lang=", "{{Interlinear|lang=", "{{Lang|",
+             "{{Not a typo", "{{chinese", "{{code", "{{infobox Chinese", "{{infobox chinese",
+             "{{interlinear | lang=", "{{interlinear |lang=", "{{interlinear| lang=", "{{interlinear|lang=", "{{lang|",
+             "{{not a typo"))
+        self.assertEqual(get_triggers(re.compile(r"\[\[(File|Image):.*?(\||\])", flags=re.I+re.S)), ("[[file:", "[[image:"))
+        self.assertEqual(get_triggers(re.compile(r"{{(x|\w+z)")), ("{{",))
+
 
 class WordCategorizerTest(unittest.TestCase):
+    def test_bounded_edit_distance(self):
+        self.assertEqual(bounded_edit_distance("qwerty", "qwerty", 1), 0)
+        self.assertEqual(bounded_edit_distance("qwerty", "qwrety", 1), 1)
+        self.assertEqual(bounded_edit_distance("qwerty", "qwerti", 1), 1)
+        self.assertEqual(bounded_edit_distance("qwerty", "werty", 1), 1)
+        self.assertEqual(bounded_edit_distance("qwerty", "wqerti", 1), 2)
+        self.assertEqual(bounded_edit_distance("qwerty", "wqerti", 2), 2)
+        self.assertEqual(bounded_edit_distance("qwerty", "qw", 1), 2)
+
+    def test_symspell_suggestions(self):
+        symspell_dict = make_symspell_dict(["qwerty", "qwertyuiop", "asd", "a"], 1)
+        self.assertEqual(get_symspell_suggestions("qwrety", 1, symspell_dict.get), [(1, "qwerty")])
+        self.assertEqual(get_symspell_suggestions("qwertyuiopp", 1, symspell_dict.get), [(1, "qwertyuiop")])
+        self.assertEqual(get_symspell_suggestions("ad", 1, symspell_dict.get), [(1, "a"), (1, "asd")])
+        self.assertEqual(get_symspell_suggestions("ad", 1, symspell_dict.get, top_k=1), [(1, "a")])
+        self.assertEqual(get_symspell_suggestions("zxcv", 1, symspell_dict.get), [])
+
     def test_letters_introduced(self):
         self.assertTrue(letters_introduced_alphabetically("aAbB"))
         self.assertTrue(letters_introduced_alphabetically("AbcabD"))
@@ -228,6 +395,10 @@ class SpellTest(unittest.TestCase):
     def test_unknown_html_tag(self):
         self.assertFalse(is_word_spelled_correctly("<nowiki/>"))
 
+    def test_classify_words(self):
+        words = ["entirely-wet", "<nowiki/>", "Ḩasan", "entirely-wet", "you", ""]
+        self.assertEqual(classify_words(words), [is_word_spelled_correctly(word) for word in words])
+
     def test_transliterations(self):
         # Dashes in a proper noun
         self.assertTrue(is_word_spelled_correctly("Anbār-e"))
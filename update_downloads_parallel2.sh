@@ -8,7 +8,9 @@ cd /var/local/moss/bulk-wikipedia/
 echo `date`
 
 rm -f enwiki-latest-pages-articles-multistream.xml.bz2
+rm -f enwiki-latest-pages-articles-multistream-index.txt.bz2
 wget -o - --no-verbose https://dumps.wikimedia.org/enwiki/latest/enwiki-latest-pages-articles-multistream.xml.bz2
+wget -o - --no-verbose https://dumps.wikimedia.org/enwiki/latest/enwiki-latest-pages-articles-multistream-index.txt.bz2
 
 # Wait until here to kick this off to keep only one dump server
 # connection at a time
@@ -19,15 +21,14 @@ echo "parallel4 launched"
 cd /var/local/moss/bulk-wikipedia/
 
 echo `date`
-echo "Decompressing enwiki multistream..."
-bunzip2 enwiki-latest-pages-articles-multistream.xml.bz2
-# About 2 hours
-
-echo `date`
-echo "Converting enwiki XML to CSV..."
-# About 4 h 40 min
+echo "Converting enwiki multistream dump to article store..."
+# Decompresses and parses bz2 streams in parallel, without writing the
+# decompressed XML to disk.  Replaces bunzip2 (about 2 hours) followed
+# by xml_to_csv.py (about 4 h 40 min).
+# moss_dump_analyzer.py reads the .bin article store in preference to
+# the CSV; see article_store.py
 cd $ORIG_DIR
-venv/bin/python3 xml_to_csv.py /var/local/moss/bulk-wikipedia/enwiki-latest-pages-articles-multistream.xml > /var/local/moss/bulk-wikipedia/enwiki-articles-no-redir.csv
+venv/bin/python3 multistream_to_store.py /var/local/moss/bulk-wikipedia/enwiki-latest-pages-articles-multistream.xml.bz2 /var/local/moss/bulk-wikipedia/enwiki-articles-no-redir.bin /var/local/moss/bulk-wikipedia/enwiki-latest-pages-articles-multistream-index.txt.bz2
 
 echo `date`
 echo "Done."
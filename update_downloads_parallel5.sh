@@ -29,5 +29,10 @@ cd $ORIG_DIR
 venv/bin/python3 extract_english.py > /var/local/moss/bulk-wikipedia/english_words_only.txt
 # extract_english.py takes about 2.5 hours
 
+echo `date`
+echo "Indexing spelling suggestions..."
+venv/bin/python3 word_categorizer.py --build-suggestions
+# Skipped (seconds) if english_words_only.txt hasn't changed
+
 echo `date`
 echo "Done."
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# Persistent store of spellcheck verdicts (answers from
+# spell.is_word_spelled_correctly()), so a run can start with a warm
+# cache instead of re-running the whole spell.py cascade for every
+# common word in every worker process.
+#
+# One SQLite file holds the verdicts, how many articles each word was
+# seen in (so the most common words can be loaded first), and a
+# version string (a digest of the code and word lists the verdicts
+# depend on, see result_cache.get_files_version()).  If the version
+# changes, the old verdicts are discarded.  Several processes (pool
+# workers, and reports running at the same time) can use the same
+# file; each adds its new verdicts in batches.
+#
+# The file also collects cache statistics from every process in a
+# run, so the parent can report totals at the end.
+
+import sqlite3
+
+ANSWER_CODES = {False: 0, True: 1, "uncertain": 2}
+CODE_ANSWERS = {code: answer for (answer, code) in ANSWER_CODES.items()}
+STAT_NAMES = ["hits", "shared_hits", "misses", "evictions"]
+
+
+def open_store(filename, version):
+    # Waits for other processes that are writing at the same time
+    connection = sqlite3.connect(filename, timeout=300)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = OFF")
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("CREATE TABLE IF NOT EXISTS verdicts (word TEXT PRIMARY KEY, answer INTEGER, uses INTEGER)")
+        connection.execute("CREATE TABLE IF NOT EXISTS stats (run_id TEXT, pid INTEGER, "
+                           + ", ".join(f"{name} INTEGER" for name in STAT_NAMES)
+                           + ", PRIMARY KEY (run_id, pid))")
+        row = connection.execute("SELECT value FROM metadata WHERE key = 'version'").fetchone()
+        if not row or row[0] != version:
+            connection.execute("DELETE FROM verdicts")
+            connection.execute("INSERT OR REPLACE INTO metadata VALUES ('version', ?)", [version])
+    return connection
+
+
+def read_verdicts(connection, limit):
+    # Returns up to limit (word, answer) pairs, most used first
+    rows = connection.execute("SELECT word, answer FROM verdicts ORDER BY uses DESC LIMIT ?", [limit])
+    return [(word, CODE_ANSWERS[code]) for (word, code) in rows]
+
+
+def lookup_verdict(connection, word):
+    # Returns the stored answer for word, or None
+    row = connection.execute("SELECT answer FROM verdicts WHERE word = ?", [word]).fetchone()
+    if row is None:
+        return None
+    return CODE_ANSWERS[row[0]]
+
+
+def add_verdicts(connection, verdicts):
+    # verdicts is a dictionary of word -> (answer, number of uses)
+    with connection:
+        connection.executemany("INSERT INTO verdicts VALUES (?, ?, ?) "
+                               "ON CONFLICT (word) DO UPDATE SET answer = excluded.answer, uses = uses + excluded.uses",
+                               [(word, ANSWER_CODES[answer], uses) for (word, (answer, uses)) in verdicts.items()])
+
+
+def save_stats(connection, run_id, pid, stats):
+    # stats is a dictionary with the totals so far for this process
+    with connection:
+        connection.execute(f"INSERT OR REPLACE INTO stats VALUES (?, ?, {', '.join('?' for _ in STAT_NAMES)})",
+                           [run_id, pid] + [stats[name] for name in STAT_NAMES])
+
+
+def collect_stats(connection, run_id):
+    # Returns the totals from all processes for run_id, and removes
+    # them from the store
+    with connection:
+        row = connection.execute(f"SELECT {', '.join(f'SUM({name})' for name in STAT_NAMES)} FROM stats WHERE run_id = ?",
+                                 [run_id]).fetchone()
+        connection.execute("DELETE FROM stats WHERE run_id = ?", [run_id])
+    return {name: value or 0 for (name, value) in zip(STAT_NAMES, row)}
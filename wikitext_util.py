@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import os
 import re
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # Python < 3.11
+    import sre_parse
 
 contractions = {
     # Sourced from
@@ -157,62 +163,307 @@ ignore_tags_re = re.compile(r"{{\s*(([Cc]opy|[Mm]ove|[Cc]opy section) to \w+"
 
 
 def remove_structure_nested(string, open_string, close_string):
-    # TODO: Write tests
     # Sample inputs and outputs:
-    # ("aaa {{bbb {{ccc}} ddd}} eee", "{{, "}}") -> "aaa  eee"
-    # ("bbb {{ccc}} ddd}} eee", "{{, "}}") -> "bbb  ddd}} eee"
-
-    string_clean = ""
+    # ("aaa {{bbb {{ccc}} ddd}} eee", "{{", "}}") -> "aaa ✂✂✂ eee"
+    # ("bbb {{ccc}} ddd}} eee", "{{", "}}") -> "bbb ✂ ddd}} eee"
+
+    # Single scan from left to right; position is the start of the
+    # text not yet processed.  The next open_string and close_string
+    # are only searched for again once position has moved past them,
+    # so the text is scanned about once however many templates there
+    # are, and the output is assembled at the end.
+    pieces = []
     nesting_depth = 0
+    position = 0
+    open_length = len(open_string)
+    close_length = len(close_string)
+    open_index = string.find(open_string)
+    close_index = string.find(close_string)
 
     # Use iteration instead of recursion to avoid exceeding maximum
     # recursion depth in articles with more than 500 template
     # instances
-    while open_string in string:
-        open_index = string.find(open_string)  # Always > -1 inside this loop
-        close_index = string.find(close_string)
-
+    while open_index > -1:
         if nesting_depth == 0:
             # Save text to the beginning of the template and open a new one
-            string_clean += string[:open_index]
-            string = string[open_index+2:]
+            pieces.append(string[position:open_index])
+            position = open_index + open_length
             nesting_depth += 1
-            continue
-
-        # nesting_depth > 0 from here on...
-
-        if close_index == -1 and nesting_depth > 0:
+        elif close_index == -1:
             # Unbalanced (too many open_string)
             # Drop string
-            return string_clean
-
-        if close_index > -1 and nesting_depth > 0:
-            if close_index < open_index:
-                # Discard text to the end of the template, close it,
-                # and check for further templates
-                string_clean += "✂"
-                string = string[close_index+2:]
-                nesting_depth -= 1
-                continue
-            else:
-                # Discard text to the beginning of the template and
-                # open a new one
-                string_clean += "✂"
-                string = string[open_index+2:]
-                nesting_depth += 1
-                continue
+            return "".join(pieces)
+        elif close_index < open_index:
+            # Discard text to the end of the template, close it,
+            # and check for further templates
+            pieces.append("✂")
+            position = close_index + close_length
+            nesting_depth -= 1
+        else:
+            # Discard text to the beginning of the template and open
+            # a new one
+            pieces.append("✂")
+            position = open_index + open_length
+            nesting_depth += 1
+
+        if open_index < position:
+            open_index = string.find(open_string, position)
+        if -1 < close_index < position:
+            close_index = string.find(close_string, position)
 
-    while nesting_depth > 0 and close_string in string:
+    while nesting_depth > 0 and close_index > -1:
         # Remove this template and close
-        string_clean += "✂"
-        close_index = string.find(close_string)
-        string = string[close_index+2:]
+        pieces.append("✂")
+        position = close_index + close_length
+        close_index = string.find(close_string, position)
         nesting_depth -= 1
 
     # Note: if close_string is in string and nesting_depth == 0,
     # close_string gets included in the output string due to
     # imbalance (too many close_string)
-    return string_clean + string
+    pieces.append(string[position:])
+    return "".join(pieces)
+
+
+# --- Substitution lists ---
+
+# wikitext_to_plaintext() and get_main_body_wikitext() apply long
+# lists of (regex, replacement) pairs in order.  Most of the regexes
+# don't match most articles, so compile_substitutions() turns each list
+# into steps that can be checked cheaply first: each step has
+# "triggers", literal strings at least one of which must be in the text
+# for the regex to match, and the step is skipped if none are.  Runs of
+# plain strings that are replaced by other plain strings are combined
+# into a single regex where that can't change the result.  The output
+# is the same as applying each substitution in turn with regex.sub().
+
+
+def get_required_strings(parsed):
+    # Returns literal strings that every match of the parsed regex
+    # contains
+    strings = []
+    string = ""
+    for (op, av) in parsed:
+        if op is sre_parse.LITERAL:
+            string += chr(av)
+            continue
+        if string:
+            strings.append(string)
+            string = ""
+        if op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            strings.extend(get_required_strings(av[3]))
+    if string:
+        strings.append(string)
+    return strings
+
+
+def get_literal_prefixes(parsed, limit=64):
+    # Returns a list of (prefix, complete) such that every match of the
+    # parsed regex starts with one of the prefixes; complete means the
+    # prefix is the whole match.  Alternatives, optional groups and
+    # small character classes like [Nn] are expanded, up to limit
+    # prefixes.
+    prefixes = [""]
+    for (op, av) in parsed:
+        if op is sre_parse.LITERAL:
+            prefixes = [prefix + chr(av) for prefix in prefixes]
+            continue
+        if op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+            alternatives = get_literal_prefixes(av[3], limit)
+        elif op is sre_parse.BRANCH:
+            alternatives = [alternative for branch in av[1] for alternative in get_literal_prefixes(branch, limit)]
+        elif op is sre_parse.IN and len(av) <= 4 and all(item_op is sre_parse.LITERAL for (item_op, _) in av):
+            alternatives = [(chr(item_av), True) for (_, item_av) in av]
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] == 0 and av[1] == 1:
+            alternatives = [("", True)] + get_literal_prefixes(av[2], limit)
+        else:
+            break
+        if len(prefixes) * len(alternatives) > limit:
+            break
+        prefixes = [prefix + alternative for prefix in prefixes for (alternative, _) in alternatives]
+        if not all(complete for (_, complete) in alternatives):
+            return [(prefix, False) for prefix in prefixes]
+    else:
+        return [(prefix, True) for prefix in prefixes]
+    return [(prefix, False) for prefix in prefixes]
+
+
+def get_parsed_triggers(parsed, ignore_case):
+    strings = get_required_strings(parsed)
+    if ignore_case:
+        # Compared to fold_case() of the text, which only works for
+        # ASCII
+        strings = [ascii_part.lower() for string in strings for ascii_part in re.findall(r"[\x00-\x7f]+", string)]
+    candidates = []
+    if strings:
+        candidates.append((max(strings, key=len),))
+
+    # Or one string from each alternative at the start, which may be
+    # longer (and so less likely to be found when there's no match)
+    if parsed and parsed[0][0] is sre_parse.SUBPATTERN and not parsed[0][1][1] and not parsed[0][1][2]:
+        candidates.append(get_parsed_triggers(parsed[0][1][3], ignore_case))
+    if parsed and parsed[0][0] is sre_parse.BRANCH:
+        branch_triggers = [get_parsed_triggers(branch, ignore_case) for branch in parsed[0][1][1]]
+        if all(branch_triggers):
+            triggers = set(trigger for triggers in branch_triggers for trigger in triggers)
+            # Any string containing another one is redundant
+            candidates.append(tuple(sorted(trigger for trigger in triggers
+                                           if not any(other in trigger for other in triggers if other != trigger))))
+
+    # Or the possible beginnings of a match, when they are literal
+    prefixes = [prefix for (prefix, _) in get_literal_prefixes(parsed)]
+    if ignore_case:
+        prefixes = [re.match(r"[\x00-\x7f]*", prefix).group().lower() for prefix in prefixes]
+    if all(prefixes):
+        prefixes = set(prefixes)
+        candidates.append(tuple(sorted(prefix for prefix in prefixes
+                                       if not any(other in prefix for other in prefixes if other != prefix))))
+
+    candidates = [triggers for triggers in candidates if triggers]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda triggers: min(len(trigger) for trigger in triggers))
+
+
+def get_triggers(regex):
+    # Returns strings at least one of which must be in any text regex
+    # matches, or None
+    ignore_case = bool(regex.flags & re.IGNORECASE)
+    return get_parsed_triggers(sre_parse.parse(regex.pattern, regex.flags), ignore_case)
+
+
+def fold_case(string):
+    # Lowercases string so that anything that matches an ASCII string
+    # under re.IGNORECASE contains that string in lowercase.  Besides
+    # upper and lower case, re.IGNORECASE matches "İ" and "ı" to "i"
+    # and "ſ" to "s".
+    if "İ" in string:
+        # Otherwise lowercased to two characters
+        string = string.replace("İ", "i")
+    string = string.lower()
+    if "ı" in string:
+        string = string.replace("ı", "i")
+    if "ſ" in string:
+        string = string.replace("ſ", "s")
+    return string
+
+
+def get_plain_string(regex):
+    # Returns the string regex matches if it only matches that string
+    # exactly, otherwise None
+    if regex.flags & re.IGNORECASE:
+        return None
+    parsed = sre_parse.parse(regex.pattern, regex.flags)
+    if not parsed or any(op is not sre_parse.LITERAL for (op, _) in parsed):
+        return None
+    return "".join(chr(av) for (_, av) in parsed)
+
+
+def strings_overlap(string1, string2):
+    if string1 in string2 or string2 in string1:
+        return True
+    return any(string1.endswith(string2[:length]) or string2.endswith(string1[:length])
+               for length in range(1, min(len(string1), len(string2))))
+
+
+def can_combine(group, string, replacement):
+    # Doing all the replacements in group and (string, replacement) in
+    # one pass gives the same result as doing them one after another
+    # if matches can't overlap, and no replacement can create a new
+    # match for a later string.  Replacing with "" can join text on
+    # either side into a new match, so that has to be the end of a
+    # group.
+    for (group_string, group_replacement) in group:
+        if not group_replacement or strings_overlap(group_string, string):
+            return False
+        if any(character in string for character in group_replacement):
+            return False
+    return True
+
+
+def combine_strings(group):
+    # Steps with no regex are done with str.replace()
+    if len(group) == 1:
+        (string, replacement) = group[0]
+        return (None, replacement, (string,), False, None)
+    replacements = {}
+    for (string, replacement) in group:
+        # Later duplicates never match
+        replacements.setdefault(string, replacement)
+    regex = re.compile("|".join(re.escape(string) for string in replacements))
+    prefix = os.path.commonprefix(list(replacements))
+    triggers = (prefix,) if prefix else tuple(replacements)
+    return (regex, lambda match: replacements[match.group()], triggers, False, None)
+
+
+# Checking the triggers of a case-insensitive step needs the text
+# lowercased with fold_case(), which takes about as long as searching
+# the text 8 times, but only needs to be redone after a substitution
+# changes the text.  Lists with fewer case-insensitive steps than this
+# search for each step's triggers with a case-insensitive regex
+# instead.
+FOLD_CASE_MIN_STEPS = 8
+
+# Searching for more triggers than this one at a time takes longer
+# than one regex search for all of them
+MAX_PLAIN_TRIGGERS = 2
+
+
+def make_trigger_re(triggers, ignore_case):
+    return re.compile("|".join(re.escape(trigger) for trigger in triggers), re.IGNORECASE if ignore_case else 0)
+
+
+def compile_substitutions(substitutions_list):
+    # Returns steps for apply_substitutions()
+    steps = []
+    group = []
+    for (regex, replacement) in substitutions_list:
+        string = get_plain_string(regex)
+        if string is not None and "\\" not in replacement:
+            if group and not can_combine(group, string, replacement):
+                steps.append(combine_strings(group))
+                group = []
+            group.append((string, replacement))
+            continue
+        if group:
+            steps.append(combine_strings(group))
+            group = []
+        steps.append((regex, replacement, get_triggers(regex), bool(regex.flags & re.IGNORECASE), None))
+    if group:
+        steps.append(combine_strings(group))
+
+    fold_case_steps = sum(1 for (_, _, triggers, ignore_case, _) in steps if triggers and ignore_case)
+    for (index, (regex, replacement, triggers, ignore_case, _)) in enumerate(steps):
+        if not triggers:
+            continue
+        if len(triggers) > MAX_PLAIN_TRIGGERS or (ignore_case and fold_case_steps < FOLD_CASE_MIN_STEPS):
+            steps[index] = (regex, replacement, triggers, ignore_case, make_trigger_re(triggers, ignore_case))
+    return steps
+
+
+def apply_substitutions(string, steps):
+    folded_string = None
+    for (regex, replacement, triggers, ignore_case, trigger_re) in steps:
+        if triggers:
+            if trigger_re:
+                if not trigger_re.search(string):
+                    continue
+            elif ignore_case:
+                if folded_string is None:
+                    folded_string = fold_case(string)
+                if not any(trigger in folded_string for trigger in triggers):
+                    continue
+            elif not any(trigger in string for trigger in triggers):
+                continue
+        if regex is None:
+            # The trigger is the whole string to replace, and it's there
+            string = string.replace(triggers[0], replacement)
+            folded_string = None
+            continue
+        (string, count) = regex.subn(replacement, string)
+        if count:
+            folded_string = None
+    return string
 
 
 # These have to happen before templates are stripped out.
@@ -437,7 +688,9 @@ substitutions = [
     # list and table items on their own lines
     (re.compile(r"\n\s*\n+"), r"\n\n"),
     (re.compile(r"^\s*\n+"), r"\n"),
-    (re.compile(r"(?<!^)(?<![=\n✂\}\]\|])\n(?![\n=\*#:;✂ \|])"), r" "),
+    # (Starts with \n so the regex engine can search for that quickly;
+    # the lookbehind checks the character before it.)
+    (re.compile(r"\n(?<=[^=\n✂\}\]\|]\n)(?![\n=\*#:;✂ \|])"), r" "),
     (re.compile(r"\n\n+"), r"\n"),
     (re.compile(r"  +"), " "),
 
@@ -464,6 +717,11 @@ substitutions_bold_italics = [
 ]
 
 
+early_substitution_steps = compile_substitutions(early_substitutions)
+substitution_steps = compile_substitutions(substitutions)
+substitution_sub_sup_steps = compile_substitutions(substitutions_sub_sup)
+
+
 # This function does not preserve all elements in the wikitext where
 # non-linear rendering or template substitution would be required, so
 # some information on the page is lost.  It is intended for use with
@@ -471,8 +729,7 @@ substitutions_bold_italics = [
 # leave complicated markup (including math-in-prose) unverified.  Some
 # wikitext features, like section headers, are left intact.
 def wikitext_to_plaintext(string, flatten_sup_sub=True):
-    for (regex, replacement) in early_substitutions:
-        string = regex.sub(replacement, string)
+    string = apply_substitutions(string, early_substitution_steps)
 
     # TODO: Spell check visible contents of these special constructs
     string = remove_structure_nested(string, "{{", "}}")
@@ -482,12 +739,10 @@ def wikitext_to_plaintext(string, flatten_sup_sub=True):
     # the article.
     string = remove_structure_nested(string, "|-", "|}")
 
-    for (regex, replacement) in substitutions:
-        string = regex.sub(replacement, string)
+    string = apply_substitutions(string, substitution_steps)
 
     if flatten_sup_sub:
-        for (regex, replacement) in substitutions_sub_sup:
-            string = regex.sub(replacement, string)
+        string = apply_substitutions(string, substitution_sub_sup_steps)
 
     return string
 
@@ -534,33 +789,38 @@ line_starts_with_re = re.compile(r"\n[ :†][^\n]*")
 wikt_line_starts_with_re = re.compile(r"\n#\*[^\n]*")
 # Quotations, often with archaic spelling
 
-
-def get_main_body_wikitext(wikitext_input, strong=False, wiktionary=False):
-    # Ignore non-prose and segments not parsed for grammar, spelling, etc.
-
+main_body_steps = compile_substitutions([
     # TODO: Get smarter about these sections.  But for now, ignore
     # them, since they are full of proper nouns and URL words.
-    wikitext_working = ignore_sections_re.sub("", wikitext_input)
+    (ignore_sections_re, ""),
+
+    (prose_quote_re, "✂"),
+    (prose_quote_curly_re, "✂"),
+    (bold_italics_re, r"\1✂\3"),
+    (italics_re, r"\1✂\3"),
+    (single_quote_re, r"\1✂\3"),
+    (blockquote_re, "✂"),
+    (ignore_headers_re, ""),
+    (line_starts_with_re, ""),
+] + substitutions_bold_italics)  # Must be done after italics_re
+strong_steps = compile_substitutions([
+    (parenthetical_re, ""),
+    (ignore_lists_re, ""),
+])
+wiktionary_steps = compile_substitutions([
+    (wikt_line_starts_with_re, ""),
+])
 
-    wikitext_working = prose_quote_re.sub("✂", wikitext_working)
-    wikitext_working = prose_quote_curly_re.sub("✂", wikitext_working)
-    wikitext_working = bold_italics_re.sub(r"\1✂\3", wikitext_working)
-    wikitext_working = italics_re.sub(r"\1✂\3", wikitext_working)
-    wikitext_working = single_quote_re.sub(r"\1✂\3", wikitext_working)
-    wikitext_working = blockquote_re.sub("✂", wikitext_working)
-    wikitext_working = ignore_headers_re.sub("", wikitext_working)
-    wikitext_working = line_starts_with_re.sub("", wikitext_working)
 
-    # Must be done after italics_re
-    for (regex, replacement) in substitutions_bold_italics:
-        wikitext_working = regex.sub(replacement, wikitext_working)
+def get_main_body_wikitext(wikitext_input, strong=False, wiktionary=False):
+    # Ignore non-prose and segments not parsed for grammar, spelling, etc.
+    wikitext_working = apply_substitutions(wikitext_input, main_body_steps)
 
     if strong:
-        wikitext_working = parenthetical_re.sub("", wikitext_working)
-        wikitext_working = ignore_lists_re.sub("", wikitext_working)
+        wikitext_working = apply_substitutions(wikitext_working, strong_steps)
 
     if wiktionary:
-        wikitext_working = wikt_line_starts_with_re.sub("", wikitext_working)
+        wikitext_working = apply_substitutions(wikitext_working, wiktionary_steps)
 
     """
     # TODO: Do the same thing for italics and single quote passages
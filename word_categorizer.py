@@ -31,23 +31,31 @@
 from collections import defaultdict
 import datetime
 import fileinput
+from functools import partial
 import gcld3
+import glob
+import hashlib
 from multiprocessing import Pool
 from nltk.metrics import distance
+import os
 import re
 import sys
 import unicodedata
 
 try:
     from sectionalizer import get_word
-    from spell import bad_characters
+    from spell import has_bad_characters
     from spell import bad_words
     from wikitext_util import html_tag_re
+    from word_table import (load_word_table, open_word_multimap, word_multimap_get, word_table_contains,
+                            word_table_words, write_word_multimap)
 except ImportError:
     from .sectionalizer import get_word
-    from .spell import bad_characters
+    from .spell import has_bad_characters
     from .spell import bad_words
     from .wikitext_util import html_tag_re
+    from .word_table import (load_word_table, open_word_multimap, word_multimap_get, word_table_contains,
+                             word_table_words, write_word_multimap)
 
 az_re = re.compile(r"^[a-z']+$", flags=re.I)
 az_plus_re = re.compile(r"^[a-z|\d|\-|\.']+$", flags=re.I)
@@ -85,11 +93,18 @@ google_lang_detector = gcld3.NNetLanguageIdentifier(min_num_bytes=0,
 # -- INITIALIZATION HELPERS AND GLOBAL VARIABLES --
 
 
+# Set by load_data().  These are memory-mapped word tables (see
+# word_table.py) built next to the source files, so pool workers share
+# one copy.
 titles_all_wiktionaries = None
 transliterations = None
 english_wiktionary = None
 english_words = None
-suggestion_dict = None  # Keys are length, then low-fi match sets
+suggestion_dict = None  # Index for SUGGESTION_BACKEND; see load_suggestion_dict()
+
+TITLES_ALL_WIKTIONARIES_FILE = "/var/local/moss/bulk-wikipedia/titles_all_wiktionaries_uniq.txt"
+TRANSLITERATIONS_FILE = "/var/local/moss/bulk-wikipedia/transliterations.txt"
+ENGLISH_WORDS_FILE = "/var/local/moss/bulk-wikipedia/english_words_only.txt"
 
 # Edit distance 4 and greater gives a negligible true positive rate
 # Though even 2 and 3 are more non-typos than typos, especially if
@@ -97,6 +112,18 @@ suggestion_dict = None  # Keys are length, then low-fi match sets
 # those.
 MAX_EDIT_DISTANCE = 1
 
+# "lowfi" (low-fi match sets, lossy above edit distance 1) or
+# "symspell" (symmetric delete index, exact); set MOSS_SUGGESTION_BACKEND
+# to choose
+SUGGESTION_BACKEND = os.environ.get("MOSS_SUGGESTION_BACKEND") or "lowfi"
+if SUGGESTION_BACKEND not in ("lowfi", "symspell"):
+    raise Exception(f"Unknown suggestion backend {SUGGESTION_BACKEND}")
+
+# Symmetric delete index entries are only made from this many leading
+# characters of each word, which keeps the index small without losing
+# any suggestions (candidates are checked against the whole word).
+SYMSPELL_PREFIX_LENGTH = 7
+
 
 # From http://norvig.com/spell-correct.html
 # All edits that are one edit away from "word".
@@ -114,7 +141,7 @@ def check_dictionary(word_list, edit_distance_target, this_edit_distance=1):
     edited_string_sets = [edits1(word) for word in word_list]
     edited_strings = set()
     edited_strings.update(*edited_string_sets)
-    found_strings = [s for s in edited_strings if s in english_words]
+    found_strings = [s for s in edited_strings if word_table_contains(english_words, s)]
     if found_strings:
         return (this_edit_distance, found_strings)
     if this_edit_distance == edit_distance_target:
@@ -204,6 +231,79 @@ def make_suggestion_dict(input_list):
     return suggestion_dict
 
 
+# Symmetric delete spelling correction, after
+# https://github.com/wolfgarbe/SymSpell
+#
+# Two strings within edit distance N of each other always have a
+# common string that can be produced by deleting at most N characters
+# from each.  So the index maps every string made by deleting up to
+# MAX_EDIT_DISTANCE characters from (the prefix of) each dictionary
+# word back to the word, and lookups generate the same deletes from
+# the misspelled word.
+def make_deletes(word, max_distance):
+    deletes = {word}
+    edges = {word}
+    for _ in range(max_distance):
+        edges = {edge[:i] + edge[i + 1:] for edge in edges for i in range(len(edge))}
+        deletes.update(edges)
+    return deletes
+
+
+def make_symspell_dict(input_list, max_distance):
+    symspell_dict = defaultdict(set)
+    for word in input_list:
+        for delete in make_deletes(word[:SYMSPELL_PREFIX_LENGTH], max_distance):
+            symspell_dict[delete].add(word)
+    return symspell_dict
+
+
+def bounded_edit_distance(string1, string2, max_distance):
+    # Damerau-Levenshtein (optimal string alignment) distance, or
+    # max_distance + 1 as soon as it's known to be higher than
+    # max_distance.
+    if string1 == string2:
+        return 0
+    if abs(len(string1) - len(string2)) > max_distance:
+        return max_distance + 1
+    previous_previous_row = None
+    previous_row = list(range(len(string2) + 1))
+    for i in range(1, len(string1) + 1):
+        row = [i] + [0] * len(string2)
+        for j in range(1, len(string2) + 1):
+            cost = 0 if string1[i - 1] == string2[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and string1[i - 1] == string2[j - 2] and string1[i - 2] == string2[j - 1]:
+                row[j] = min(row[j], previous_previous_row[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+        (previous_previous_row, previous_row) = (previous_row, row)
+    return min(previous_row[-1], max_distance + 1)
+
+
+def get_symspell_suggestions(word, max_distance, lookup_function, top_k=None):
+    # Returns a list of (edit distance, suggestion) for all dictionary
+    # words within max_distance of word, closest (then alphabetically
+    # first) first.  lookup_function takes a delete string and returns
+    # the matching dictionary words, or None.
+    candidates = set()
+    for delete in make_deletes(word[:SYMSPELL_PREFIX_LENGTH], max_distance):
+        candidates.update(lookup_function(delete) or [])
+
+    suggestions = []
+    for candidate in candidates:
+        if max_distance > 1:
+            # Optimal string alignment distance can be higher than
+            # full Damerau-Levenshtein distance once there are two or
+            # more edits, so use the same measure as the low-fi backend
+            candidate_distance = distance.edit_distance(word, candidate, transpositions=True)
+        else:
+            candidate_distance = bounded_edit_distance(word, candidate, max_distance)
+        if candidate_distance <= max_distance:
+            suggestions.append((candidate_distance, candidate))
+    suggestions.sort()
+    return suggestions[:top_k]
+
+
 # -- Chemistry ---
 
 
@@ -382,13 +482,13 @@ def is_english_compound(word):
 
     parts = word.split("-")
     if len(parts) > 1:
-        if all(part in english_words for part in parts):
+        if all(word_table_contains(english_words, part) for part in parts):
             return True
         return False
 
     pairs = [(word[0:i], word[i:]) for i in range(1, len(word))]
     for pair in pairs:
-        if pair[0] in english_words and pair[1] in english_words:
+        if word_table_contains(english_words, pair[0]) and word_table_contains(english_words, pair[1]):
             return True
     return False
 
@@ -414,9 +514,15 @@ def get_anychar_permutations(word):
 # MAX_EDIT_DISTANCE
 def near_common_word(word):
     word = word.lower()
-    if word in english_words:
+    if word_table_contains(english_words, word):
         return 0
 
+    if SUGGESTION_BACKEND == "symspell":
+        suggestions = get_symspell_suggestions(word, MAX_EDIT_DISTANCE, partial(word_multimap_get, suggestion_dict), top_k=1)
+        if suggestions:
+            return suggestions[0]
+        return (False, False)
+
     lowfi_strings = {make_lowfi_string(permu) for permu in get_anychar_permutations(word)}
     # PERFORMANCE NOTE: Can be made more efficient by doing equivalent
     # of get_anychar_permutations() knowing we only care about lowfi
@@ -426,8 +532,7 @@ def near_common_word(word):
     for edit_distance in range(1, MAX_EDIT_DISTANCE + 1):
         matches = []  # List to avoid excessive de-dup comparisons
         for lowfi_string in lowfi_strings:
-            if lowfi_string in suggestion_dict[edit_distance]:
-                matches.extend(list(suggestion_dict[edit_distance][lowfi_string]))
+            matches.extend(word_multimap_get(suggestion_dict, f"{edit_distance}\t{lowfi_string}") or [])
         matches = {match for match in matches if abs(len(match) - len(word)) <= MAX_EDIT_DISTANCE}
         if edit_distance > 1:
             # A little lossy, but greatly improves performance
@@ -469,7 +574,7 @@ def get_word_category(word):
     if word in bad_words:
         # "I'm"
         return "BW"
-    if any([bad_char in word for bad_char in bad_characters]):
+    if has_bad_characters(word):
         # (bad character or substring)
         return "BC"
 
@@ -489,7 +594,7 @@ def get_word_category(word):
     #
     # TODO: Find the language of the word by Wikitionary lookup
     # instead of fuzzy language identification.
-    if word in titles_all_wiktionaries:
+    if word_table_contains(titles_all_wiktionaries, word):
         return tag_by_lang(word)
 
     if is_url_or_filename(word):
@@ -501,7 +606,7 @@ def get_word_category(word):
     elif az_plus_re.match(word):
         if az_re.match(word):
             (edit_distance, suggestion) = near_common_word(word)
-            if word in transliterations:
+            if word_table_contains(transliterations, word):
                 category = "L"
             elif is_rhyme_scheme(word):
                 category = "P"
@@ -577,6 +682,51 @@ def process_input_parallel():
         pool.join()
 
 
+def read_transliterations(source_file):
+    return {line.strip().split("\t")[1] for line in source_file
+            if "\t" in line.strip() and "_" not in line}
+
+
+def get_suggestions_filename():
+    # The index depends only on the contents of the word list (not its
+    # timestamp, which changes on every download), the backend and the
+    # edit distance, so indexes for each distance can be kept side by
+    # side.
+    file_hash = hashlib.blake2b(digest_size=8)
+    with open(ENGLISH_WORDS_FILE, "rb") as word_file:
+        for chunk in iter(lambda: word_file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return f"{ENGLISH_WORDS_FILE}.{SUGGESTION_BACKEND}{MAX_EDIT_DISTANCE}-{file_hash.hexdigest()}"
+
+
+def build_suggestion_index(suggestions_filename):
+    print("Indexing English spelling suggestions...", file=sys.stderr)
+    input_list = [w for w in word_table_words(english_words) if az_re.match(w)]
+    if SUGGESTION_BACKEND == "symspell":
+        # Keys are delete strings
+        write_word_multimap(suggestions_filename, make_symspell_dict(input_list, MAX_EDIT_DISTANCE))
+    else:
+        # Keys are "edit distance<TAB>low-fi match set"
+        suggestion_dict_by_distance = make_suggestion_dict(input_list)
+        write_word_multimap(suggestions_filename,
+                            {f"{edit_distance}\t{lowfi_string}": words
+                             for (edit_distance, suggestions) in suggestion_dict_by_distance.items()
+                             for (lowfi_string, words) in suggestions.items()})
+
+    # Indexes for previous versions of the word list won't be used again
+    file_hash = suggestions_filename.rsplit("-", 1)[1]
+    for old_filename in glob.glob(f"{ENGLISH_WORDS_FILE}.{SUGGESTION_BACKEND}*-*"):
+        if not old_filename.endswith(file_hash) and not old_filename.endswith(".new"):
+            os.remove(old_filename)
+
+
+def load_suggestion_dict():
+    suggestions_filename = get_suggestions_filename()
+    if not os.path.exists(suggestions_filename):
+        build_suggestion_index(suggestions_filename)
+    return open_word_multimap(suggestions_filename)
+
+
 # Separate function so these don't have to be loaded for unit tests,
 # but can be loaded when importing functions that need all the data.
 def load_data():
@@ -584,44 +734,35 @@ def load_data():
     global transliterations
     global english_words
     global suggestion_dict
-    global english_words_by_length_and_letter
 
     # Any words in multi-word phrases should also be listed as individual
     # words, so don't bother tokenizing.  TODO: Drop multi-word phrases
     # (at list creation time?) since these won't be matched anyway.
     print(datetime.datetime.now(), file=sys.stderr)
     print("Loading all languages...", file=sys.stderr)
-    with open("/var/local/moss/bulk-wikipedia/titles_all_wiktionaries_uniq.txt", "r") as title_list:
-        titles_all_wiktionaries = set([line.strip() for line in title_list])
+    titles_all_wiktionaries = load_word_table(TITLES_ALL_WIKTIONARIES_FILE)
 
     print("Loading transliterations...", file=sys.stderr)
-    with open("/var/local/moss/bulk-wikipedia/transliterations.txt", "r") as title_list:
-        transliterations = set([line.strip().split("\t")[1] for line in title_list
-                                if "\t" in line.strip() and "_" not in line])
+    transliterations = load_word_table(TRANSLITERATIONS_FILE, read_transliterations)
 
     print("Loading English words only...", file=sys.stderr)
-    with open("/var/local/moss/bulk-wikipedia/english_words_only.txt", "r") as title_list:
-        english_words = set([line.strip() for line in title_list])
-
-    print("Indexing English words by length...", file=sys.stderr)
-    english_words_by_length_and_letter = defaultdict(dict)
-    for word in [w.lower() for w in english_words if az_re.match(w)]:
-        existing_dict = english_words_by_length_and_letter[len(word)]
-        first_letter = word[0]
-        if first_letter not in existing_dict:
-            existing_dict[first_letter] = {word}
-        else:
-            existing_dict[first_letter].add(word)
+    english_words = load_word_table(ENGLISH_WORDS_FILE)
 
     print(datetime.datetime.now(), file=sys.stderr)
-    print("Indexing English spelling suggestions...", file=sys.stderr)
-    suggestion_dict = make_suggestion_dict([w for w in english_words if az_re.match(w)])
+    print("Loading English spelling suggestions...", file=sys.stderr)
+    suggestion_dict = load_suggestion_dict()
 
     print("Done loading.", file=sys.stderr)
     print(datetime.datetime.now(), file=sys.stderr)
 
 
 if __name__ == '__main__':
+    if sys.argv[1:] == ["--build-suggestions"]:
+        # Run after extract_english.py, so reports don't have to
+        english_words = load_word_table(ENGLISH_WORDS_FILE)
+        load_suggestion_dict()
+        exit(0)
+
     load_data()
 
     process_input_parallel()
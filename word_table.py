@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# Read-only sets of strings, and maps from strings to lists of
+# strings, stored in a file.  For large word lists that are slow to
+# rebuild and expensive to hold as Python objects in every process:
+# the file is memory-mapped, so it loads instantly and all processes
+# (including forked pool workers) share one copy in the page cache.
+#
+# File layout:
+#   TABLE_MAGIC (word set) or MULTIMAP_MAGIC (map to lists of words)
+#   TABLE_HEADER (number of slots, number of keys)
+#   Slots: one SLOT per slot; 0 for empty, otherwise 1 + the offset of
+#     an entry in the entries area.  Open addressing with linear
+#     probing on the CRC32 of the key; the number of slots is a power
+#     of two at least twice the number of keys.
+#   Entries, for each key:
+#     WORD_LENGTH (byte length) then the UTF-8 bytes of the key
+#     For multimaps only: VALUE_COUNT, then for each value,
+#       WORD_LENGTH and the UTF-8 bytes of the value
+
+from array import array
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+TABLE_MAGIC = b"MOSSWRD1"
+MULTIMAP_MAGIC = b"MOSSMAP1"
+TABLE_HEADER = struct.Struct("<II")
+SLOT = struct.Struct("<I")
+WORD_LENGTH = struct.Struct("<H")
+VALUE_COUNT = struct.Struct("<I")
+
+
+def pack_word(word):
+    word_bytes = word.encode("utf-8")
+    return WORD_LENGTH.pack(len(word_bytes)) + word_bytes
+
+
+def write_table(filename, magic, entries):
+    # entries is a list of (key, packed entry bytes)
+    slot_count = 1
+    while slot_count < 2 * len(entries):
+        slot_count *= 2
+    mask = slot_count - 1
+
+    slots = array("I", bytes(SLOT.size * slot_count))
+    entries_bytes = bytearray()
+    for (key, entry_bytes) in entries:
+        slot = zlib.crc32(key.encode("utf-8")) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = len(entries_bytes) + 1
+        entries_bytes += entry_bytes
+    if len(entries_bytes) >= 2 ** 32 - 1:
+        raise Exception(f"Too much text for word table: {len(entries_bytes)} bytes")
+    if sys.byteorder != "little":
+        slots.byteswap()
+
+    # Written under a temporary name so processes using the old table
+    # are not affected, and processes building the same table at the
+    # same time don't collide
+    new_filename = f"{filename}.{os.getpid()}.new"
+    with open(new_filename, "wb") as table_file:
+        table_file.write(magic)
+        table_file.write(TABLE_HEADER.pack(slot_count, len(entries)))
+        table_file.write(slots.tobytes())
+        table_file.write(entries_bytes)
+    os.replace(new_filename, filename)
+    return len(entries)
+
+
+def write_word_table(filename, words):
+    return write_table(filename, TABLE_MAGIC, [(word, pack_word(word)) for word in words])
+
+
+def write_word_multimap(filename, mapping):
+    # mapping is a dictionary of key -> iterable of words
+    entries = []
+    for (key, words) in mapping.items():
+        words = list(words)
+        entries.append((key, pack_word(key) + VALUE_COUNT.pack(len(words)) + b"".join(pack_word(word) for word in words)))
+    return write_table(filename, MULTIMAP_MAGIC, entries)
+
+
+def open_table(filename, magic):
+    with open(filename, "rb") as table_file:
+        data = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[:len(magic)] != magic:
+        raise Exception(f"Not a word table of the expected type: {filename}")
+    (slot_count, _) = TABLE_HEADER.unpack_from(data, len(magic))
+    slots_start = len(magic) + TABLE_HEADER.size
+    entries_start = slots_start + SLOT.size * slot_count
+    return (data, slot_count - 1, slots_start, entries_start)
+
+
+def open_word_table(filename):
+    # Returns a table for word_table_contains()
+    return open_table(filename, TABLE_MAGIC)
+
+
+def open_word_multimap(filename):
+    # Returns a table for word_multimap_get()
+    return open_table(filename, MULTIMAP_MAGIC)
+
+
+def find_entry(table, key):
+    # Returns the offset just past the key of the entry for key, or
+    # None if it's not in the table
+    (data, mask, slots_start, entries_start) = table
+    key_bytes = key.encode("utf-8")
+    slot = zlib.crc32(key_bytes) & mask
+    while True:
+        (position,) = SLOT.unpack_from(data, slots_start + SLOT.size * slot)
+        if not position:
+            return None
+        key_start = entries_start + position - 1 + WORD_LENGTH.size
+        (length,) = WORD_LENGTH.unpack_from(data, key_start - WORD_LENGTH.size)
+        if length == len(key_bytes) and data[key_start:key_start + length] == key_bytes:
+            return key_start + length
+        slot = (slot + 1) & mask
+
+
+def word_table_contains(table, word):
+    return find_entry(table, word) is not None
+
+
+def read_words(data, position, count):
+    words = []
+    for _ in range(count):
+        (length,) = WORD_LENGTH.unpack_from(data, position)
+        position += WORD_LENGTH.size
+        words.append(str(data[position:position + length], "utf-8"))
+        position += length
+    return (words, position)
+
+
+def word_multimap_get(table, key):
+    # Returns the list of words for key, or None
+    position = find_entry(table, key)
+    if position is None:
+        return None
+    data = table[0]
+    (count,) = VALUE_COUNT.unpack_from(data, position)
+    return read_words(data, position + VALUE_COUNT.size, count)[0]
+
+
+def word_table_words(table):
+    # Word sets only
+    (data, _, _, entries_start) = table
+    position = entries_start
+    while position < len(data):
+        ([word], position) = read_words(data, position, 1)
+        yield word
+
+
+def is_table_current(table_filename, source_filenames):
+    if not os.path.exists(table_filename):
+        return False
+    table_mtime = os.path.getmtime(table_filename)
+    return all(os.path.getmtime(filename) <= table_mtime for filename in source_filenames)
+
+
+def read_stripped_lines(source_file):
+    return {line.strip() for line in source_file}
+
+
+def load_word_table(source_filename, read_function=read_stripped_lines):
+    # Opens the word table built from source_filename, first
+    # (re)building it if the source file is newer.  read_function
+    # takes the open source file and returns the words.
+    table_filename = source_filename + ".table"
+    if not is_table_current(table_filename, [source_filename]):
+        print(f"Building {table_filename}...", file=sys.stderr)
+        with open(source_filename, "r") as source_file:
+            write_word_table(table_filename, read_function(source_file))
+    return open_word_table(table_filename)